@@ -1,47 +1,182 @@
+import sys
+import pathlib
 import streamlit as st
 import sqlite3
 import pandas as pd
 import plotly.express as px
 
+# バッチの共通モジュールを読み込めるようにする
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1].joinpath("batch")))
+import search  # noqa: E402
+import query  # noqa: E402
+import rollup  # noqa: E402
+
 # ページ設定
 st.set_page_config(page_title="株式ナビ", layout="wide")
 
+# 自動更新の間隔（秒）
+REFRESH_SECONDS = 60
+
 # 期間の選択肢リスト
-PERIOD_OPTIONS = [("1年", 12), ("6ヶ月", 6), ("3ヶ月", 3), ("1ヶ月", 1), ("2週間", 0.5), ("1週間", 0.25)]
+PERIOD_OPTIONS = [("10年", 120), ("5年", 60), ("3年", 36), ("1年", 12), ("6ヶ月", 6), ("3ヶ月", 3), ("1ヶ月", 1), ("2週間", 0.5), ("1週間", 0.25)]
 
 with st.sidebar:
     # ページ選択
-    page = st.radio("ページを選択", ["N225", "17業種別指数", "設定"])
+    page = st.radio("ページを選択", ["N225", "銘柄検索", "17業種別指数", "自作指数", "ファンダメンタル", "バックテスト", "設定"])
 
-    # 期間選択で1ヶ月,3ヶ月,6ヶ月,1年を選択できるようにする
-    period = st.radio("期間", [item[0] for item in PERIOD_OPTIONS], index=0)
+    # 期間選択で1週間〜10年を選択できるようにする（初期値は1年）
+    period = st.radio("期間", [item[0] for item in PERIOD_OPTIONS], index=3)
+
+    # 自動更新（日足のみ、追加された行だけを読み込んでグラフを更新する）
+    live = st.toggle("自動更新", value=False, help=f"{REFRESH_SECONDS}秒ごとに追加されたデータのみ読み込みます。")
 
 # SQLiteからデータを取得する
 DB_PATH = "data/stocks.db"
 
 
+# 期間に応じて読み込むテーブルの足を選択する関数（5年以上は月足、3年以上は週足、それ以外は日足）
+def resolution(period: float) -> str:
+    if period >= 60:
+        return "月足"
+    elif period >= 36:
+        return "週足"
+    return "日足"
+
+
 # 指定された期間のデータを読み込む関数
 @st.cache_data(show_spinner=False)
-def load(code_list: list, period: float) -> pd.DataFrame:
+def load(code_list: list, period: float, table_name: str = "株価データ") -> pd.DataFrame:
     try:
         with sqlite3.connect("db.sqlite3") as conn:
 
-            # code_listに基づいてSQLクエリを動的に生成
-            codes_str = ",".join([f"'{code}'" for code in code_list])
-            query = f"select * from 株価データ where コード in ({codes_str})"
-            df = pd.read_sql_query(query, conn)
-
-            # 日付のyyyMMdd形式のintegerをdate型に変換して読み込む
-            df["日付"] = pd.to_datetime(df["日付"], format="%Y-%m-%d")
-
-            # 期間に応じてデータをフィルタリング
+            # 期間の開始日を求める
             if period < 1:
-                df = df[df["日付"] >= pd.Timestamp.now() - pd.DateOffset(weeks=int(period * 4))]
+                start = pd.Timestamp.now() - pd.DateOffset(weeks=int(period * 4))
             else:
-                df = df[df["日付"] >= pd.Timestamp.now() - pd.DateOffset(months=int(period))]
+                start = pd.Timestamp.now() - pd.DateOffset(months=int(period))
+
+            # 自動更新で読み込む行の起点として、読み込み時点の最終 rowid を記録する
+            rowid = conn.execute(f"select coalesce(max(rowid), 0) from {table_name}").fetchone()[0]
+
+            # 期間に応じた足のテーブル（日足は列ファイルとアーカイブDBを含む）から期間内のデータのみ読み込む
+            df = pd.concat(query.series(conn, table_name, code_list, start, resolution=resolution(period), columns=["終値"]), ignore_index=True)
+
             # 日付、コードが"0000","0002"、⋯で横持ちに変換する
             df = df.pivot(index="日付", columns="コード", values="終値").reset_index()
             df.columns.name = None
+            df.attrs["rowid"] = rowid
+            return df
+    except Exception as e:
+        st.error(f"DB読み込みエラー: {e}")
+        return None
+
+
+# 指定された rowid より後に追加された行のみ読み込む関数（rowid が振り直された場合は None を返す）
+def load_delta(code_list: list, rowid: int, table_name: str = "株価データ") -> pd.DataFrame:
+    with sqlite3.connect("db.sqlite3") as conn:
+        # VACUUM などで rowid が振り直されると追加された行を判定できない
+        if conn.execute(f"select coalesce(max(rowid), 0) from {table_name}").fetchone()[0] < rowid:
+            return None
+        placeholders = ",".join("?" * len(code_list))
+        query = f"select rowid, コード, 日付, 終値 from {table_name} where rowid > ? and コード in ({placeholders})"
+        df = pd.read_sql_query(query, conn, params=[rowid] + [str(code) for code in code_list])
+        df["コード"] = df["コード"].astype(str)
+        df["日付"] = rollup.parse_dates(df["日付"])
+        return df
+
+
+# セッションに保持したデータに追加された行のみ反映して返す関数（日足のみ。週足・月足は load のキャッシュを使う）
+def refresh(key: str, code_list: list, period: float, table_name: str = "株価データ") -> pd.DataFrame:
+    if resolution(period) != "日足":
+        st.session_state.pop(key, None)
+        return load(code_list, period, table_name)
+
+    # 初回または期間・銘柄が変わった場合は期間のデータを読み込む
+    state = st.session_state.get(key)
+    if state is None or state["period"] != period or state["codes"] != code_list:
+        df = load(code_list, period, table_name)
+        if df is None:
+            return None
+        state = {"period": period, "codes": list(code_list), "df": df, "rowid": df.attrs.get("rowid", 0)}
+
+    # 前回の rowid より後に追加された行を末尾に追加する（rowid が振り直された場合はキャッシュを破棄して読み込み直す）
+    try:
+        delta = load_delta(code_list, state["rowid"], table_name)
+        if delta is None:
+            load.clear()
+            df = load(code_list, period, table_name)
+            if df is None:
+                return None
+            state = {"period": period, "codes": list(code_list), "df": df, "rowid": df.attrs.get("rowid", 0)}
+            delta = pd.DataFrame()
+    except Exception as e:
+        st.error(f"DB読み込みエラー: {e}")
+        delta = pd.DataFrame()
+    if not delta.empty:
+        state["rowid"] = int(delta["rowid"].max())
+        delta = delta.pivot_table(index="日付", columns="コード", values="終値", aggfunc="last").reset_index()
+        state["df"] = pd.concat([state["df"], delta], ignore_index=True).groupby("日付", as_index=False).last()
+
+    st.session_state[key] = state
+    return state["df"].copy()
+
+
+# 銘柄検索の索引から銘柄を検索する関数
+@st.cache_data(show_spinner=False, max_entries=1000)
+def search_stocks(query: str) -> pd.DataFrame:
+    try:
+        with sqlite3.connect("db.sqlite3") as conn:
+            return search.search(conn, query)
+    except Exception as e:
+        st.error(f"DB読み込みエラー: {e}")
+        return None
+
+
+# 自作指数のコードと指数名の一覧を読み込む関数
+@st.cache_data(show_spinner=False)
+def load_custom_indices() -> pd.DataFrame:
+    try:
+        with sqlite3.connect("db.sqlite3") as conn:
+            return pd.read_sql_query("select distinct コード, 指数名 from 自作指数データ order by コード", conn)
+    except Exception as e:
+        st.error(f"DB読み込みエラー: {e}")
+        return None
+
+
+# ファクターデータを読み込む関数
+@st.cache_data(show_spinner=False)
+def load_factors() -> pd.DataFrame:
+    try:
+        with sqlite3.connect("db.sqlite3") as conn:
+            query = """
+                select m.銘柄名, m."33業種区分", m."市場・商品区分", f.*
+                from ファクターデータ f left join 銘柄マスタ m on cast(m.コード as text) = f.コード
+            """
+            return pd.read_sql_query(query, conn)
+    except Exception as e:
+        st.error(f"DB読み込みエラー: {e}")
+        return None
+
+
+# バックテスト結果を読み込む関数
+@st.cache_data(show_spinner=False)
+def load_backtests() -> pd.DataFrame:
+    try:
+        with sqlite3.connect("db.sqlite3") as conn:
+            return pd.read_sql_query("select * from バックテスト結果", conn)
+    except Exception as e:
+        st.error(f"DB読み込みエラー: {e}")
+        return None
+
+
+# バックテストの資産推移を読み込む関数
+@st.cache_data(show_spinner=False)
+def load_equity(run_id: str, params: list) -> pd.DataFrame:
+    try:
+        with sqlite3.connect("db.sqlite3") as conn:
+            query = f"select * from バックテスト資産推移 where 実行ID = ? and パラメータ in ({','.join('?' * len(params))})"
+            df = pd.read_sql_query(query, conn, params=[run_id] + params)
+            df["日付"] = pd.to_datetime(df["日付"], format="%Y-%m-%d")
             return df
     except Exception as e:
         st.error(f"DB読み込みエラー: {e}")
@@ -51,19 +186,49 @@ def load(code_list: list, period: float) -> pd.DataFrame:
 if page == "N225":
     st.subheader("🏠 日経225")
 
-    # データ読み込み
-    df = load(["N225"], next(item for item in PERIOD_OPTIONS if item[0] == period)[1])
-
-    if df is not None:
-        # 日経225のグラフを表示
-        fig = px.line(df, x="日付", y="N225", labels={"日付": "日付", "N225": "日経225"})
-        # １周間前から本日までの背景色を赤色にする
-        one_week_ago = pd.Timestamp.now() - pd.DateOffset(weeks=1)
-        fig.add_vrect(x0=one_week_ago, x1=pd.Timestamp.now(), fillcolor="green", opacity=0.1, layer="below", line_width=0)
-        st.plotly_chart(fig, width="stretch")
-    else:
-        st.warning("データが取得できませんでした。")
+    # 自動更新の場合はグラフのみ一定間隔で再実行する
+    @st.fragment(run_every=REFRESH_SECONDS if live else None)
+    def n225_chart(period_value: float) -> None:
+        # データ読み込み（追加された行のみ反映）
+        df = refresh("N225", ["N225"], period_value)
+
+        if df is not None:
+            # 日経225のグラフを表示
+            fig = px.line(df, x="日付", y="N225", labels={"日付": "日付", "N225": "日経225"})
+            # １周間前から本日までの背景色を赤色にする
+            one_week_ago = pd.Timestamp.now() - pd.DateOffset(weeks=1)
+            fig.add_vrect(x0=one_week_ago, x1=pd.Timestamp.now(), fillcolor="green", opacity=0.1, layer="below", line_width=0)
+            st.plotly_chart(fig, width="stretch")
+        else:
+            st.warning("データが取得できませんでした。")
+
+    n225_chart(next(item for item in PERIOD_OPTIONS if item[0] == period)[1])
+
+
+elif page == "銘柄検索":
+    st.subheader("🔍 銘柄検索")
 
+    # コード、銘柄名、読みで検索（全角・半角、ひらがな・カタカナは区別しない）
+    keyword = st.text_input("コード・銘柄名", placeholder="例: 7203、トヨタ、とよた")
+    stocks = search_stocks(keyword) if keyword else None
+
+    if stocks is not None and stocks.empty:
+        st.warning("該当する銘柄がありません。")
+    elif stocks is not None:
+        names = dict(zip(stocks["コード"], stocks["銘柄名"]))
+        code = st.selectbox("銘柄", list(names), format_func=lambda code: f"{code} {names[code]}")
+
+        # 選択した銘柄の株価のグラフを表示（自動更新の場合はグラフのみ一定間隔で再実行する）
+        @st.fragment(run_every=REFRESH_SECONDS if live else None)
+        def stock_chart(code: str, period_value: float) -> None:
+            df = refresh("銘柄検索", [code], period_value)
+            if df is None or code not in df.columns:
+                st.warning("データが取得できませんでした。")
+            else:
+                fig = px.line(df, x="日付", y=code, labels={"日付": "日付", code: names[code]})
+                st.plotly_chart(fig, width="stretch")
+
+        stock_chart(code, next(item for item in PERIOD_OPTIONS if item[0] == period)[1])
 
 elif page == "17業種別指数":
     st.subheader("📈 17業種別指数チャート")
@@ -93,6 +258,85 @@ elif page == "17業種別指数":
         )
         st.plotly_chart(fig, use_container_width=True)
 
+elif page == "自作指数":
+    st.subheader("🧮 自作指数チャート")
+
+    # 指数の一覧を読み込み
+    indices = load_custom_indices()
+
+    if indices is None or indices.empty:
+        st.warning("データが取得できませんでした。")
+    else:
+        # 表示する指数を選択（初期値は市場区分の時価総額加重）
+        names = dict(zip(indices["コード"], indices["指数名"]))
+        default = [code for code in names if code.startswith("CAP-市場-")]
+        codes = st.multiselect("指数", list(names), default=default, format_func=lambda code: names[code])
+
+        # 自動更新の場合はグラフのみ一定間隔で再実行する
+        @st.fragment(run_every=REFRESH_SECONDS if live else None)
+        def custom_index_chart(codes: list, period_value: float) -> None:
+            df = refresh("自作指数", codes, period_value, "自作指数データ") if codes else None
+
+            if df is None or df.empty:
+                st.warning("データが取得できませんでした。")
+            else:
+                # 期間の最初の値を1として比較できるようにする
+                codes = [code for code in codes if code in df.columns]
+                df[codes] = df[codes] / df[codes].bfill().iloc[0]
+
+                fig = px.line(df, x="日付", y=codes, labels={"日付": "日付", "value": "指数", "variable": "指数"})
+                fig.for_each_trace(lambda trace: trace.update(name=names[trace.name]))
+                st.plotly_chart(fig, width="stretch")
+
+        custom_index_chart(codes, next(item for item in PERIOD_OPTIONS if item[0] == period)[1])
+
+elif page == "ファンダメンタル":
+    st.subheader("📊 ファンダメンタル")
+
+    # データ読み込み
+    df = load_factors()
+
+    if df is None:
+        st.warning("データが取得できませんでした。")
+    else:
+        # ランキングするファクターと並び順を選択
+        factors = [col for col in df.columns if col not in ["コード", "銘柄名", "33業種区分", "市場・商品区分", "決算期", "決算期（kabu+）", "株価日付", "計算日時", "売上高", "純利益", "営業キャッシュフロー"]]
+        col1, col2, col3 = st.columns(3)
+        factor = col1.selectbox("ファクター", factors, index=factors.index("ROE") if "ROE" in factors else 0)
+        ascending = col2.radio("並び順", ["降順", "昇順"], horizontal=True) == "昇順"
+        markets = col3.multiselect("市場", sorted(df["市場・商品区分"].dropna().unique()))
+
+        # 市場で絞り込んでファクターの順に並べる
+        if markets:
+            df = df[df["市場・商品区分"].isin(markets)]
+        df = df.dropna(subset=[factor]).sort_values(factor, ascending=ascending)
+        st.dataframe(df.head(100), width="stretch", hide_index=True)
+
+elif page == "バックテスト":
+    st.subheader("🧪 バックテスト")
+
+    # データ読み込み
+    df = load_backtests()
+
+    if df is None or df.empty:
+        st.warning("データが取得できませんでした。")
+    else:
+        # 実行を選択（新しい順）
+        runs = df[["実行ID", "戦略"]].drop_duplicates().sort_values("実行ID", ascending=False)
+        run = st.selectbox("実行", runs.itertuples(index=False), format_func=lambda r: f"{r.実行ID} {r.戦略}")
+        df = df[df["実行ID"] == run.実行ID].sort_values("シャープレシオ", ascending=False)
+
+        # 評価指標の一覧
+        st.dataframe(df.drop(columns=["実行ID", "戦略", "パラメータ"]), width="stretch", hide_index=True)
+
+        # シャープレシオ上位の資産推移のグラフを表示
+        params = st.multiselect("資産推移を表示するパラメータ", df["パラメータ"].tolist(), default=df["パラメータ"].head(5).tolist())
+        if params:
+            equity = load_equity(run.実行ID, params)
+            if equity is not None:
+                fig = px.line(equity, x="日付", y="資産", color="パラメータ", labels={"日付": "日付", "資産": "資産"})
+                st.plotly_chart(fig, width="stretch")
+
 elif page == "設定":
     st.subheader("設定")
     dark = st.checkbox("ダークモード (デモ)")
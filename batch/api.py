@@ -0,0 +1,247 @@
+import sys
+import io
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+import query
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+"""
+他のツールから db.sqlite3 を直接開かずにデータを読めるようにするローカルのデータAPI。
+アプリと同じ読み込み処理（query.py）を使い、NDJSON または Arrow IPC ストリームを chunked 転送で少しずつ返す。
+DB が更新されていない間は、同じリクエストの小さい応答をメモリにキャッシュして返す。
+
+GET /prices?codes=7203,6758&start=2024-01-01&end=2024-12-31&resolution=日足&format=ndjson
+GET /indices?codes=N225&table=指数データ|自作指数データ&start=...&resolution=週足
+GET /indicators?codes=7203&date=2024-12-30
+GET /financials?table=損益計算書_PL&codes=7203&items=Total Revenue,Net Income
+GET /factors?codes=7203
+"""
+
+# 待ち受けるホストとポート（ローカルのみ）
+HOST = "127.0.0.1"
+PORT = 8600
+
+# DBのパス
+DB_PATH = "db.sqlite3"
+
+# キャッシュする応答の件数と1件の最大バイト数
+CACHE_ENTRIES = 128
+CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+# 応答するパス
+PATHS = ["/prices", "/indices", "/indicators", "/financials", "/factors"]
+
+# 応答の形式と Content-Type
+CONTENT_TYPES = {"ndjson": "application/x-ndjson", "arrow": "application/vnd.apache.arrow.stream"}
+
+# 応答のキャッシュ（キーはパス、クエリ、DBの更新時刻）
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def split(value: str) -> list:
+    """
+    カンマ区切りのパラメータをリストにします。空の場合は None を返します。
+    """
+    return [item.strip() for item in value.split(",") if item.strip()] if value else None
+
+
+def frames(path: str, params: dict, conn: sqlite3.Connection):
+    """
+    パスとパラメータに応じた DataFrame を順に返します。
+
+    Args:
+        path (str): リクエストのパス。
+        params (dict): クエリパラメータ（値は文字列）。
+        conn (sqlite3.Connection): SQLite のコネクション。
+
+    Returns:
+        Iterator[pd.DataFrame]: 応答する DataFrame。
+    """
+    codes = split(params.get("codes"))
+    start = pd.Timestamp(params["start"]) if params.get("start") else None
+    end = pd.Timestamp(params["end"]) if params.get("end") else None
+    resolution = params.get("resolution", "日足")
+
+    if path == "/prices":
+        return query.series(conn, "株価データ", codes, start, end, resolution, split(params.get("columns")))
+    elif path == "/indices":
+        table_name = params.get("table", "指数データ")
+        if table_name not in ["指数データ", "自作指数データ"]:
+            raise ValueError(f"{table_name} は指数のテーブルではありません")
+        return query.series(conn, table_name, codes, start, end, resolution, split(params.get("columns")))
+    elif path == "/indicators":
+        date = pd.Timestamp(params["date"]) if params.get("date") else None
+        return iter([query.indicators(conn, codes, date)])
+    elif path == "/financials":
+        return iter([query.financials(conn, params.get("table", "財務諸表_FIN"), codes, split(params.get("items")))])
+    elif path == "/factors":
+        return iter([query.factors(conn, codes)])
+    raise ValueError(f"{path} は存在しません")
+
+
+def to_ndjson(df: pd.DataFrame) -> bytes:
+    """
+    DataFrame を NDJSON に変換します。日付は yyyy-MM-dd の文字列にします。
+    """
+    df = df.copy()
+    for col in df.columns[df.dtypes.map(pd.api.types.is_datetime64_any_dtype)]:
+        df[col] = df[col].dt.strftime("%Y-%m-%d")
+    return df.to_json(orient="records", lines=True, force_ascii=False).rstrip("\n").encode("utf-8") + b"\n" if not df.empty else b""
+
+
+def encode(chunks, fmt: str):
+    """
+    DataFrame を順に応答の形式のバイト列に変換します。
+
+    Args:
+        chunks (Iterator[pd.DataFrame]): frames の戻り値。
+        fmt (str): 形式（ndjson, arrow）。
+
+    Yields:
+        bytes: 応答のバイト列。
+    """
+    if fmt == "ndjson":
+        for df in chunks:
+            data = to_ndjson(df)
+            if data:
+                yield data
+        return
+
+    # Arrow は最初の DataFrame のスキーマでストリームを開き、以降は同じスキーマに変換して追加する
+    sink = io.BytesIO()
+    writer = None
+    for df in chunks:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if writer is None:
+            schema = table.schema
+            writer = pa.ipc.new_stream(sink, schema)
+        writer.write_table(table.cast(schema))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    if writer is not None:
+        writer.close()
+        yield sink.getvalue()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    データAPIのリクエストを処理します。
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path not in PATHS:
+            self.send_error_json(404, f"{url.path} は存在しません")
+            return
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        fmt = params.get("format", "ndjson")
+        if fmt not in CONTENT_TYPES or (fmt == "arrow" and pa is None):
+            self.send_error_json(400, f"{fmt} の形式には対応していません")
+            return
+
+        # DB が更新されていなければキャッシュした応答を返す
+        key = (url.path, url.query, os.stat(DB_PATH).st_mtime_ns)
+        with _cache_lock:
+            cached = _cache.get(key)
+            if cached is not None:
+                _cache.move_to_end(key)
+        if cached is not None:
+            self.send_chunks(fmt, [cached])
+            return
+
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+        try:
+            chunks = frames(url.path, params, conn)
+            first = next(chunks)
+        except Exception as e:
+            conn.close()
+            self.send_error_json(400, str(e))
+            return
+
+        # 最初の DataFrame を読めたら応答を開始し、以降は読み込みながら送る
+        try:
+            body = self.send_chunks(fmt, encode(self.prepend(first, chunks), fmt))
+        finally:
+            conn.close()
+
+        if body is not None:
+            with _cache_lock:
+                _cache[key] = body
+                while len(_cache) > CACHE_ENTRIES:
+                    _cache.popitem(last=False)
+
+    @staticmethod
+    def prepend(first: pd.DataFrame, chunks):
+        """
+        先に読み込んだ DataFrame を先頭に戻します。
+        """
+        yield first
+        yield from chunks
+
+    def send_chunks(self, fmt: str, data) -> bytes:
+        """
+        バイト列を chunked 転送で送ります。
+
+        Returns:
+            bytes: 応答全体が CACHE_MAX_BYTES 以下の場合は応答全体、それ以外は None。
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[fmt])
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        body = []
+        size = 0
+        for chunk in data:
+            if not chunk:
+                continue
+            self.wfile.write(f"{len(chunk):X}\r\n".encode("ascii") + chunk + b"\r\n")
+            size += len(chunk)
+            # キャッシュの上限を超えたら応答全体は保持しない
+            if body is not None and size <= CACHE_MAX_BYTES:
+                body.append(chunk)
+            else:
+                body = None
+        self.wfile.write(b"0\r\n\r\n")
+        return b"".join(body) if body is not None else None
+
+    def send_error_json(self, status: int, message: str) -> None:
+        """
+        エラーを JSON で返します。
+        """
+        data = json.dumps({"error": message}, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else PORT
+        server = ThreadingHTTPServer((HOST, port), Handler)
+        print(f"データAPIを起動しました。 http://{HOST}:{port}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    else:
+        print("usage: python api.py serve [ポート]")
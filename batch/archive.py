@@ -0,0 +1,175 @@
+import sys
+import sqlite3
+from pathlib import Path
+from typing import Iterator
+import pandas as pd
+import rollup
+import colstore
+
+"""
+日次のテーブルのうち保持年数より古い年のデータを年ごとのアーカイブDB（archive/yyyy.sqlite3）に移す。
+読み込み時は指定された期間がアーカイブ済みの年にかかる場合のみ、その年のアーカイブDBを ATTACH して読み込む。
+週足・月足のテーブルはアーカイブしない。
+"""
+
+# アーカイブDBを保存するディレクトリ
+ARCHIVE_DIR = Path("archive")
+
+# アーカイブするテーブル
+TABLES = ["株価データ", "指標データ", "指数データ"]
+
+# メインのDBに残す年数（今年を含まない）
+RETENTION_YEARS = 5
+
+
+def archive_path(year: int) -> Path:
+    """
+    年のアーカイブDBのパスを返します。
+    """
+    return ARCHIVE_DIR / f"{year}.sqlite3"
+
+
+def archived_years() -> list:
+    """
+    アーカイブDBのある年のリストを返します。
+    """
+    return sorted(int(path.stem) for path in ARCHIVE_DIR.glob("*.sqlite3") if path.stem.isdigit())
+
+
+def archive(conn: sqlite3.Connection, years: int = RETENTION_YEARS, vacuum: bool = False) -> None:
+    """
+    保持年数より古い年のデータをアーカイブDBに移します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        years (int): メインのDBに残す年数（今年を含まない）。
+        vacuum (bool): 移した後にメインのDBを VACUUM する場合は True。
+            VACUUM で株価データの rowid が振り直されるため、列ファイルがあれば書き出し直します。
+    """
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    cutoff_year = pd.Timestamp.now().year - years
+
+    for table_name in TABLES:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table_name,)).fetchone():
+            continue
+
+        # メインのDBに残っている最も古い年から保持年数の前の年までを移す
+        first = conn.execute(f"SELECT MIN({rollup.DATE_KEY}) FROM {table_name}").fetchone()[0]
+        if first is None:
+            continue
+
+        for year in range(int(str(first)[:4]), cutoff_year):
+            print(f"{table_name} の {year}年のデータをアーカイブ中...")
+            conn.commit()
+            conn.execute("ATTACH DATABASE ? AS archive", (str(archive_path(year)),))
+            try:
+                # アーカイブDBにテーブルがなければ同じ列で作成
+                conn.execute(f"CREATE TABLE IF NOT EXISTS archive.{table_name} AS SELECT * FROM main.{table_name} WHERE 0")
+
+                # アーカイブDBへの追加とメインのDBからの削除を同じトランザクションで行う
+                where = f"{rollup.DATE_KEY} BETWEEN ? AND ?"
+                params = (f"{year}0101", f"{year}1231")
+                conn.execute(f"INSERT INTO archive.{table_name} SELECT * FROM main.{table_name} WHERE {where}", params)
+                conn.execute(f"DELETE FROM main.{table_name} WHERE {where}", params)
+                conn.commit()
+            finally:
+                conn.execute("DETACH DATABASE archive")
+
+    if vacuum:
+        print("VACUUM を実行中...")
+        conn.execute("VACUUM")
+
+        # rowid で追加された行を判定している列ファイルを、振り直された rowid で書き出し直す
+        if colstore.read_meta()["rows"] > 0:
+            colstore.export(conn, rebuild=True)
+
+
+def read(conn: sqlite3.Connection, table_name: str, columns: str = "*", start: pd.Timestamp = None, where: str = None, params: list = None) -> pd.DataFrame:
+    """
+    テーブルを読み込みます。期間がアーカイブ済みの年にかかる場合はアーカイブDBからも読み込みます。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        table_name (str): テーブル名。
+        columns (str): 読み込む列（SELECT 句）。
+        start (pd.Timestamp): 開始日。None の場合はすべての年。
+        where (str): 追加の条件（WHERE 句）。
+        params (list): 追加の条件のパラメータ。
+
+    Returns:
+        pd.DataFrame: 読み込んだ DataFrame。
+    """
+    frames = list(iter_read(conn, table_name, columns, start, where, params))
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[-1]
+
+
+def iter_read(
+    conn: sqlite3.Connection, table_name: str, columns: str = "*", start: pd.Timestamp = None, where: str = None, params: list = None, chunksize: int = None
+) -> Iterator[pd.DataFrame]:
+    """
+    テーブルを古いアーカイブDBから順に、最後にメインのDBから読み込みます。
+    chunksize を指定した場合は全体をメモリに載せずに chunksize 行ずつ返します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        table_name (str): テーブル名。
+        columns (str): 読み込む列（SELECT 句）。
+        start (pd.Timestamp): 開始日。None の場合はすべての年。
+        where (str): 追加の条件（WHERE 句）。
+        params (list): 追加の条件のパラメータ。
+        chunksize (int): 1回に返す行数。None の場合は DB ごとにまとめて返す。
+
+    Yields:
+        pd.DataFrame: 読み込んだ DataFrame。メインのDBの分は行がなくても必ず返します。
+    """
+    conditions = []
+    query_params = []
+    if start is not None:
+        conditions.append(f"{rollup.DATE_KEY} >= ?")
+        query_params.append(pd.Timestamp(start).strftime("%Y%m%d"))
+    if where:
+        conditions.append(f"({where})")
+        query_params += list(params or [])
+    condition = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    # 開始日以降のアーカイブDBのみ ATTACH して読み込む
+    for year in archived_years():
+        if start is not None and year < pd.Timestamp(start).year:
+            continue
+        conn.commit()
+        conn.execute("ATTACH DATABASE ? AS archive", (str(archive_path(year)),))
+        try:
+            if conn.execute("SELECT 1 FROM archive.sqlite_master WHERE type='table' AND name=?", (table_name,)).fetchone():
+                query = f"SELECT {columns} FROM archive.{table_name}{condition}"
+                if chunksize is None:
+                    yield pd.read_sql_query(query, conn, params=query_params)
+                else:
+                    yield from pd.read_sql_query(query, conn, params=query_params, chunksize=chunksize)
+        finally:
+            conn.execute("DETACH DATABASE archive")
+
+    # メインのDBから読み込む
+    query = f"SELECT {columns} FROM main.{table_name}{condition}"
+    if chunksize is None:
+        yield pd.read_sql_query(query, conn, params=query_params)
+    else:
+        empty = True
+        for df in pd.read_sql_query(query, conn, params=query_params, chunksize=chunksize):
+            empty = False
+            yield df
+        if empty:
+            yield pd.read_sql_query(f"{query} LIMIT 0", conn, params=query_params)
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1 and sys.argv[1] == "run":
+        years = int(sys.argv[2]) if len(sys.argv) > 2 else RETENTION_YEARS
+        conn = sqlite3.connect("db.sqlite3")
+        try:
+            archive(conn, years, vacuum=True)
+        finally:
+            conn.close()
+        print("アーカイブが完了しました。")
+    else:
+        print("usage: python archive.py run [保持年数]")
@@ -0,0 +1,334 @@
+import sys
+import json
+import sqlite3
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import jpx
+import rollup
+import colstore
+import archive
+
+"""
+株価データの日付×コードの終値・出来高の行列に対して、単純な売買ルールをバックテストする。
+銘柄ごとのループは行わず NumPy の配列演算で計算し、パラメータの組み合わせはプロセスプールで並列に実行する。
+"""
+
+# 結果テーブル
+RESULT_TABLE = "バックテスト結果"
+
+# 資産推移テーブル
+EQUITY_TABLE = "バックテスト資産推移"
+
+# 1年の営業日数
+DAYS_PER_YEAR = 245
+
+# 戦略ごとのパラメータの組み合わせ
+GRIDS = {
+    "momentum": {
+        "lookback": [20, 60, 120, 250],
+        "skip": [0, 20],
+        "top": [0.1, 0.2],
+        "rebalance": ["W", "M"],
+        "cost_bps": [10],
+        "min_value": [100],
+    },
+    "reversal": {
+        "lookback": [5, 10, 20],
+        "skip": [0],
+        "top": [0.1, 0.2],
+        "rebalance": ["W", "M"],
+        "cost_bps": [10],
+        "min_value": [100],
+    },
+    "dividend": {
+        "lookback": [0],
+        "skip": [0],
+        "top": [0.1, 0.2, 0.3],
+        "rebalance": ["M", "Q"],
+        "cost_bps": [10],
+        "min_value": [100],
+    },
+}
+
+# ワーカープロセスで共有するデータ
+_data = None
+
+
+def load_matrix(conn: sqlite3.Connection, codes: list, years: int = 10) -> dict:
+    """
+    株価データを日付×コードの終値・出来高の行列として読み込みます。
+    指標データがある場合は配当利回り（予想）の行列も読み込みます。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        codes (list): 銘柄コードのリスト。
+        years (int): 読み込む年数。
+
+    Returns:
+        dict: 'dates', 'codes', 'close', 'volume', 'yield' の配列を持つ辞書。
+    """
+    start = (pd.Timestamp.now() - pd.DateOffset(years=years)).strftime("%Y%m%d")
+    codes = [str(code) for code in codes]
+
+    store = colstore.open_store()
+    if store is not None:
+        # 列ファイルがある場合は memmap から日付×コードの行列を読み込む
+        close = colstore.matrix(store, "終値", codes, start)
+        volume = colstore.matrix(store, "出来高", codes, start).reindex(index=close.index, columns=close.columns)
+    else:
+        df = archive.read(conn, "株価データ", "コード, 日付, 終値, 出来高", start=start)
+        df["コード"] = df["コード"].astype(str)
+        df = df[df["コード"].isin(codes)]
+        df["日付"] = rollup.parse_dates(df["日付"])
+
+        # 日付×コードの行列に変換
+        close = df.pivot_table(index="日付", columns="コード", values="終値")
+        volume = df.pivot_table(index="日付", columns="コード", values="出来高").reindex(index=close.index, columns=close.columns)
+
+    # 配当利回りは直近の値で埋める
+    dividend_yield = pd.DataFrame(np.nan, index=close.index, columns=close.columns)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='指標データ'").fetchone():
+        df = archive.read(conn, "指標データ", 'コード, 日付, "配当利回り（予想）" AS 利回り', start=start)
+        df["コード"] = df["コード"].astype(str)
+        df["日付"] = rollup.parse_dates(df["日付"])
+        dividend_yield = df.pivot_table(index="日付", columns="コード", values="利回り").reindex(columns=close.columns)
+        dividend_yield = dividend_yield.reindex(dividend_yield.index.union(close.index)).ffill().reindex(close.index)
+
+    return {
+        "dates": close.index.values,
+        "codes": close.columns.values,
+        "close": close.to_numpy(dtype=float),
+        "volume": volume.to_numpy(dtype=float),
+        "yield": dividend_yield.to_numpy(dtype=float),
+    }
+
+
+def shift(a: np.ndarray, n: int) -> np.ndarray:
+    """
+    行列を日付方向に n 日ずらします。空いた行は NaN とします。
+    """
+    if n == 0:
+        return a
+    out = np.full_like(a, np.nan)
+    out[n:] = a[:-n]
+    return out
+
+
+def signal(data: dict, strategy: str, params: dict) -> np.ndarray:
+    """
+    戦略のスコアを日付×コードの行列で返します。スコアが高い銘柄ほど優先して保有します。
+
+    Args:
+        data (dict): load_matrix の戻り値。
+        strategy (str): 戦略名（momentum, reversal, dividend）。
+        params (dict): パラメータ。
+
+    Returns:
+        np.ndarray: スコアの行列。
+    """
+    close = data["close"]
+    if strategy == "momentum":
+        # 直近 skip 日を除いた lookback 日間のリターン
+        if params["skip"] >= params["lookback"]:
+            raise ValueError(f"skip（{params['skip']}）は lookback（{params['lookback']}）より小さくしてください")
+        return shift(close, params["skip"]) / shift(close, params["lookback"]) - 1
+    elif strategy == "reversal":
+        # lookback 日間のリターンの逆数（下落した銘柄ほど高い）
+        return -(close / shift(close, params["lookback"]) - 1)
+    elif strategy == "dividend":
+        # 配当利回り（予想）
+        return data["yield"]
+    else:
+        raise NotImplementedError(f"{strategy} の戦略は未実装です")
+
+
+def rebalance_mask(dates: np.ndarray, freq: str) -> np.ndarray:
+    """
+    リバランス日（週・月・四半期の最初の営業日）の真偽値の配列を返します。
+    """
+    periods = pd.DatetimeIndex(dates).to_period(freq)
+    mask = np.ones(len(periods), dtype=bool)
+    mask[1:] = periods[1:] != periods[:-1]
+    return mask
+
+
+def target_weights(score: np.ndarray, tradable: np.ndarray, top: float) -> np.ndarray:
+    """
+    スコアの上位 top の割合の銘柄を等金額で保有するウェイトを返します。
+
+    Args:
+        score (np.ndarray): スコアの行列。
+        tradable (np.ndarray): 売買可能かの真偽値の行列。
+        top (float): 保有する銘柄の割合。
+
+    Returns:
+        np.ndarray: ウェイトの行列。各行の合計は1（保有銘柄がない行は0）。
+    """
+    score = np.where(tradable & ~np.isnan(score), score, -np.inf)
+    count = np.floor(np.sum(np.isfinite(score), axis=1) * top).astype(int)
+
+    # 行ごとのスコアの降順の順位
+    order = np.argsort(-score, axis=1, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.broadcast_to(np.arange(score.shape[1]), score.shape), axis=1)
+
+    selected = ranks < count[:, None]
+    return selected / np.maximum(count, 1)[:, None]
+
+
+def run(data: dict, strategy: str, params: dict) -> dict:
+    """
+    1つのパラメータの組み合わせでバックテストを実行します。
+    リバランス日の終値で売買し、次のリバランス日まで売買せずに保有します（ウェイトは値動きに応じて変わります）。
+
+    Args:
+        data (dict): load_matrix の戻り値。
+        strategy (str): 戦略名。
+        params (dict): パラメータ（lookback, skip, top, rebalance, cost_bps, min_value）。
+
+    Returns:
+        dict: 'params', 'metrics', 'equity' を持つ辞書。
+    """
+    close = data["close"]
+    days = len(close)
+
+    # 日次リターン（欠損は0）
+    returns = np.nan_to_num(close / shift(close, 1) - 1, nan=0.0, posinf=0.0, neginf=0.0)
+
+    # 売買可能な銘柄（終値があり、20日平均売買代金が min_value 百万円以上）
+    value = np.nan_to_num(close * data["volume"])
+    total = np.cumsum(value, axis=0)
+    average = (total - np.nan_to_num(shift(total, 20))) / 20
+    tradable = ~np.isnan(close) & (average >= params["min_value"] * 1e6)
+
+    # リバランス日の目標ウェイト
+    mask = rebalance_mask(data["dates"], params["rebalance"])
+    targets = target_weights(signal(data, strategy, params)[mask], tradable[mask], params["top"])
+
+    # 保有中のウェイトは日々の値動きで変わるため日付方向のみ順に計算する（銘柄方向は配列演算）
+    # リバランス日は値動き後のウェイトから目標ウェイトへの差を回転率とし、取引コストを差し引く
+    weights = np.zeros(close.shape[1])
+    turnover = np.zeros(days)
+    daily = np.zeros(days)
+    target_index = np.cumsum(mask) - 1
+    for t in range(days):
+        if t > 0:
+            grown = weights * (1 + returns[t])
+            daily[t] = grown.sum() - weights.sum()
+            size = grown.sum()
+            weights = grown / size if size > 0 else np.zeros_like(grown)
+        if mask[t]:
+            turnover[t] = np.abs(targets[target_index[t]] - weights).sum()
+            weights = targets[target_index[t]]
+    daily -= turnover * params["cost_bps"] / 1e4
+
+    equity = np.cumprod(1 + daily)
+    return {"params": params, "metrics": metrics(daily, equity, turnover[mask]), "equity": equity}
+
+
+def metrics(daily: np.ndarray, equity: np.ndarray, turnover: np.ndarray) -> dict:
+    """
+    日次リターンと資産推移から評価指標を計算します。
+    """
+    years = len(daily) / DAYS_PER_YEAR
+    annual_return = equity[-1] ** (1 / years) - 1 if years > 0 and equity[-1] > 0 else np.nan
+    volatility = daily.std() * np.sqrt(DAYS_PER_YEAR)
+    drawdown = equity / np.maximum.accumulate(equity) - 1
+    return {
+        "累積リターン": equity[-1] - 1,
+        "年率リターン": annual_return,
+        "年率ボラティリティ": volatility,
+        "シャープレシオ": annual_return / volatility if volatility > 0 else np.nan,
+        "最大ドローダウン": drawdown.min(),
+        "平均回転率": turnover.mean() if len(turnover) > 0 else np.nan,
+    }
+
+
+def init_worker(data: dict) -> None:
+    """
+    ワーカープロセスに行列を渡します。
+    """
+    global _data
+    _data = data
+
+
+def run_worker(strategy: str, params: dict) -> dict:
+    """
+    ワーカープロセスでバックテストを実行します。
+    """
+    return run(_data, strategy, params)
+
+
+def run_grid(data: dict, strategy: str, grid: dict, processes: int = None) -> list:
+    """
+    パラメータの組み合わせごとのバックテストをプロセスプールで並列に実行します。
+
+    Args:
+        data (dict): load_matrix の戻り値。
+        strategy (str): 戦略名。
+        grid (dict): パラメータ名をキー、候補のリストを値とする辞書。
+        processes (int): プロセス数。None の場合は CPU 数。
+
+    Returns:
+        list: run の戻り値のリスト。
+    """
+    combinations = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+    # 直近を除く日数が期間以上の組み合わせはリターンが常に0になるため除く（lookback が0の戦略は期間を使わない）
+    combinations = [params for params in combinations if params["lookback"] == 0 or params["skip"] < params["lookback"]]
+    print(f"{strategy} のバックテストを実行中... （{len(combinations)}通り）")
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_worker, initargs=(data,)) as executor:
+        return list(executor.map(run_worker, itertools.repeat(strategy), combinations))
+
+
+def store_results(conn: sqlite3.Connection, data: dict, strategy: str, results: list) -> None:
+    """
+    バックテストの評価指標と資産推移を SQLite に保存します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        data (dict): load_matrix の戻り値。
+        strategy (str): 戦略名。
+        results (list): run_grid の戻り値。
+    """
+    run_id = pd.Timestamp.now().strftime("%Y%m%d%H%M%S")
+    dates = pd.DatetimeIndex(data["dates"]).strftime("%Y-%m-%d")
+
+    df = pd.DataFrame(
+        [{"実行ID": run_id, "戦略": strategy, "パラメータ": json.dumps(result["params"]), **result["params"], **result["metrics"]} for result in results]
+    )
+    df.to_sql(RESULT_TABLE, conn, if_exists="append", index=False)
+
+    equity = pd.concat(
+        [pd.DataFrame({"実行ID": run_id, "パラメータ": json.dumps(result["params"]), "日付": dates, "資産": result["equity"]}) for result in results]
+    )
+    equity.to_sql(EQUITY_TABLE, conn, if_exists="append", index=False)
+    conn.commit()
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 2 and sys.argv[1] == "run" and sys.argv[2] in GRIDS:
+        strategy = sys.argv[2]
+
+        print("JPX銘柄一覧を読み込み中...")
+        stocks = jpx.load()
+
+        # 市場・商品区分がプライムのみに絞り込み
+        stocks = stocks[stocks["市場・商品区分"] == "プライム"]
+
+        conn = sqlite3.connect("db.sqlite3")
+        try:
+            print("株価データを読み込み中...")
+            data = load_matrix(conn, stocks["コード"].tolist())
+
+            results = run_grid(data, strategy, GRIDS[strategy])
+            store_results(conn, data, strategy, results)
+        finally:
+            conn.close()
+        print("バックテストが完了しました。")
+    else:
+        print(f"usage: python backtest.py run [{'|'.join(GRIDS)}]")
@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+import sqlite3
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import rollup
+import archive
+
+"""
+株価データを列ごとのバイナリファイルに書き出し、numpy.memmap で読み込む。
+行は日付、コードの順に並べて追記するため、期間の指定は日付の二分探索によるスライスで行える。
+複数のプロセスから同じファイルを開いてもOSのページキャッシュを共有する。
+
+colstore/株価データ/
+    meta.json   行数、最終日付、書き出し済みの最終 rowid、銘柄コードの一覧
+    日付.bin    datetime64[D]
+    コード.bin  int32（meta.json の銘柄コードの一覧の位置）
+    始値.bin, 高値.bin, 安値.bin, 終値.bin, 出来高.bin  float64
+"""
+
+# 列ごとのファイルを保存するディレクトリ
+STORE_DIR = Path("colstore") / "株価データ"
+
+# 列とデータ型
+COLUMNS = {
+    "日付": "datetime64[D]",
+    "コード": "int32",
+    "始値": "float64",
+    "高値": "float64",
+    "安値": "float64",
+    "終値": "float64",
+    "出来高": "float64",
+}
+
+
+def read_meta(directory: Path = STORE_DIR) -> dict:
+    """
+    meta.json を読み込みます。ない場合は空のメタ情報を返します。
+    """
+    path = Path(directory) / "meta.json"
+    if not path.exists():
+        return {"rows": 0, "last_date": None, "last_rowid": None, "codes": []}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_meta(meta: dict, directory: Path = STORE_DIR) -> None:
+    """
+    meta.json を書き込みます。読み込み中のプロセスが壊れたファイルを読まないように置き換えで書き込みます。
+    """
+    path = Path(directory) / "meta.json"
+    with open(path.with_suffix(".tmp"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(path.with_suffix(".tmp"), path)
+
+
+def rowids_reset(conn: sqlite3.Connection, meta: dict) -> bool:
+    """
+    メインのDBの最終 rowid が書き出し済みの最終 rowid より小さい（VACUUM や作り直しで rowid が振り直された）かを返します。
+    振り直された場合、rowid で追加された行を判定できないため列ファイルを書き出し直す必要があります。
+    """
+    if meta.get("last_rowid") is None:
+        return False
+    return conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM main.株価データ").fetchone()[0] < meta["last_rowid"]
+
+
+def export(conn: sqlite3.Connection, directory: Path = STORE_DIR, rebuild: bool = False) -> None:
+    """
+    株価データのうち書き出し済みの最終 rowid より後に追加された行を列ごとのファイルに追記します。
+    追加された行に最終日付以前の日付の行（新規上場銘柄の過去分、前回取得に失敗した銘柄の取得など）がある場合は、
+    日付順の並びを保つために全件を書き出し直します。rowid が振り直されている場合も全件を書き出し直します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        directory (Path): 書き出し先のディレクトリ。
+        rebuild (bool): 全件を書き出し直す場合は True。
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    meta = {"rows": 0, "last_date": None, "last_rowid": None, "codes": []} if rebuild else read_meta(directory)
+
+    # rowid を記録していない旧形式のメタ情報の場合は全件を書き出し直す
+    if not rebuild and meta["rows"] > 0 and meta.get("last_rowid") is None:
+        export(conn, directory, rebuild=True)
+        return
+
+    # rowid が振り直されている場合は追加された行を判定できないため全件を書き出し直す
+    if not rebuild and meta["rows"] > 0 and rowids_reset(conn, meta):
+        print("  株価データの rowid が振り直されたため、全件を書き出し直します。")
+        export(conn, directory, rebuild=True)
+        return
+
+    columns = "コード, 日付, 始値, 高値, 安値, 終値, 出来高"
+    last_rowid = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM main.株価データ").fetchone()[0]
+    if meta["rows"] > 0:
+        # メインのDBの最終 rowid より後に追加された行のみ読み込む
+        query = f"SELECT {columns} FROM main.株価データ WHERE rowid > ? AND rowid <= ?"
+        df = pd.read_sql_query(query, conn, params=[meta["last_rowid"], last_rowid])
+    else:
+        # 全件の場合はアーカイブ済みの年も含める
+        df = archive.read(conn, "株価データ", columns)
+
+    print(f"列ファイルに追記中... （{len(df)}行）")
+    if df.empty and not rebuild:
+        return
+
+    # 最終日付以前の行が追加されていれば全件を書き出し直す
+    df["日付"] = rollup.parse_dates(df["日付"])
+    if meta["last_date"] is not None and (df["日付"] <= pd.Timestamp(meta["last_date"])).any():
+        print("  最終日付以前の行が追加されたため、全件を書き出し直します。")
+        export(conn, directory, rebuild=True)
+        return
+
+    # 日付、コードの順に並べる
+    df["コード"] = df["コード"].astype(str)
+    df = df.sort_values(["日付", "コード"])
+
+    # 新しい銘柄コードは一覧の末尾に追加する
+    codes = meta["codes"] + sorted(set(df["コード"]) - set(meta["codes"]))
+    index = {code: i for i, code in enumerate(codes)}
+    df["コード"] = df["コード"].map(index)
+
+    for col, dtype in COLUMNS.items():
+        path = directory / f"{col}.bin"
+        if rebuild:
+            # 開いているプロセスの memmap を壊さないように別ファイルに書き出して置き換える
+            df[col].to_numpy().astype(dtype).tofile(path.with_suffix(".tmp"))
+            os.replace(path.with_suffix(".tmp"), path)
+        else:
+            # 途中で中断した追記の残りを切り詰めてから追記する
+            with open(path, "ab") as f:
+                f.truncate(meta["rows"] * np.dtype(dtype).itemsize)
+                df[col].to_numpy().astype(dtype).tofile(f)
+
+    # 書き込みが終わってからメタ情報を更新する
+    meta = {
+        "rows": meta["rows"] + len(df),
+        "last_date": df["日付"].max().strftime("%Y-%m-%d") if not df.empty else meta["last_date"],
+        "last_rowid": last_rowid,
+        "codes": codes,
+    }
+    write_meta(meta, directory)
+
+
+def open_store(directory: Path = STORE_DIR) -> dict:
+    """
+    列ごとのファイルを numpy.memmap で開きます。
+
+    Args:
+        directory (Path): 列ファイルのディレクトリ。
+
+    Returns:
+        dict: 列名をキー、memmap を値とする辞書と 'codes'（銘柄コードの配列）。ファイルがない場合は None。
+    """
+    meta = read_meta(directory)
+    if meta["rows"] == 0:
+        return None
+
+    # meta.json の行数までを開く（追記中の行は含めない）
+    store = {col: np.memmap(Path(directory) / f"{col}.bin", dtype=dtype, mode="r", shape=(meta["rows"],)) for col, dtype in COLUMNS.items()}
+    store["codes"] = np.array(meta["codes"])
+    return store
+
+
+def select(store: dict, codes: list = None, start: pd.Timestamp = None, end: pd.Timestamp = None) -> slice | np.ndarray:
+    """
+    銘柄コードと期間に該当する行の位置を返します。期間は日付の二分探索で求めます。
+
+    Args:
+        store (dict): open_store の戻り値。
+        codes (list): 銘柄コード。None の場合は全銘柄。
+        start (pd.Timestamp): 開始日。None の場合は最初から。
+        end (pd.Timestamp): 終了日。None の場合は最後まで。
+
+    Returns:
+        slice | np.ndarray: 行のスライス、または行の位置の配列。
+    """
+    dates = store["日付"]
+    lo = 0 if start is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(start).date(), "D"), side="left")
+    hi = len(dates) if end is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(end).date(), "D"), side="right")
+    if codes is None:
+        # 全銘柄の場合はスライスのまま返す（コピーしない）
+        return slice(lo, hi)
+
+    wanted = np.flatnonzero(np.isin(store["codes"], [str(code) for code in codes]))
+    return lo + np.flatnonzero(np.isin(store["コード"][lo:hi], wanted))
+
+
+def load(store: dict, codes: list = None, start: pd.Timestamp = None, end: pd.Timestamp = None, columns: list = None) -> pd.DataFrame:
+    """
+    株価データを縦持ちの DataFrame で読み込みます。
+
+    Args:
+        store (dict): open_store の戻り値。
+        codes (list): 銘柄コード。None の場合は全銘柄。
+        start (pd.Timestamp): 開始日。None の場合は最初から。
+        end (pd.Timestamp): 終了日。None の場合は最後まで。
+        columns (list): 読み込む列（始値、高値、安値、終値、出来高）。None の場合は全列。
+
+    Returns:
+        pd.DataFrame: 'コード', '日付' と指定した列を持つ DataFrame。
+    """
+    rows = select(store, codes, start, end)
+    columns = columns or ["始値", "高値", "安値", "終値", "出来高"]
+
+    df = pd.DataFrame({"コード": store["codes"][store["コード"][rows]], "日付": store["日付"][rows].astype("datetime64[ns]")})
+    for col in columns:
+        df[col] = store[col][rows]
+    return df
+
+
+def matrix(store: dict, column: str, codes: list = None, start: pd.Timestamp = None, end: pd.Timestamp = None) -> pd.DataFrame:
+    """
+    指定した列を日付×コードの行列で読み込みます。
+
+    Args:
+        store (dict): open_store の戻り値。
+        column (str): 列名（始値、高値、安値、終値、出来高）。
+        codes (list): 銘柄コード。None の場合は全銘柄。
+        start (pd.Timestamp): 開始日。None の場合は最初から。
+        end (pd.Timestamp): 終了日。None の場合は最後まで。
+
+    Returns:
+        pd.DataFrame: 日付をインデックス、銘柄コードを列とする DataFrame。
+    """
+    rows = select(store, codes, start, end)
+    dates, date_index = np.unique(store["日付"][rows], return_inverse=True)
+    code_ids, code_index = np.unique(store["コード"][rows], return_inverse=True)
+
+    values = np.full((len(dates), len(code_ids)), np.nan)
+    values[date_index, code_index] = store[column][rows]
+    return pd.DataFrame(values, index=pd.DatetimeIndex(dates.astype("datetime64[ns]"), name="日付"), columns=store["codes"][code_ids])
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1 and sys.argv[1] in ["update", "rebuild"]:
+        conn = sqlite3.connect("db.sqlite3")
+        try:
+            export(conn, rebuild=sys.argv[1] == "rebuild")
+        finally:
+            conn.close()
+        print("列ファイルの更新が完了しました。")
+    else:
+        print("usage: python colstore.py update|rebuild")
@@ -0,0 +1,293 @@
+import sys
+import sqlite3
+import numpy as np
+import pandas as pd
+import en2ja
+import findata
+
+"""
+決算データ_毎月、Yahoo Finance の財務データと指標データの株価から
+成長率、利益率、ROE/ROA とその変化、アクルーアル、バリュエーションのファクターを計算する。
+ファクターは全銘柄をまとめて列演算で計算し、財務データに変更のあった銘柄のみ再計算する。
+株価を使うバリュエーションは、指標データを更新するたびに全銘柄の最新の株価で計算し直す。
+"""
+
+to_ja = en2ja.to_ja
+
+# ファクターテーブル
+FACTOR_TABLE = "ファクターデータ"
+
+# ファクターの計算に使用する Yahoo Finance の財務データ（ビュー名, データ種別, 項目名）
+FIN_ITEMS = [
+    ("損益計算書_PL", "pl", ["Total Revenue", "Operating Income", "Net Income"]),
+    ("賃借対照表_BS", "bs", ["Total Assets", "Stockholders Equity"]),
+    ("キャッシュフロー計算書_CF", "cf", ["Operating Cash Flow"]),
+]
+
+# バリュエーションの計算のためにファクターテーブルに保存する財務データの値（列名, 項目名）
+VALUATION_BASES = {"売上高": "Total Revenue", "純利益": "Net Income", "営業キャッシュフロー": "Operating Cash Flow"}
+
+# 指標データから読み込む株価指標
+PRICE_COLUMNS = ["時価総額（百万円）", "PER（予想）", "PBR（実績）", "配当利回り（予想）"]
+
+# 株価から計算するバリュエーション
+VALUATION_COLUMNS = ["PSR", "益利回り", "PCFR"]
+
+
+def update_factors(conn: sqlite3.Connection, all_codes: bool = False) -> None:
+    """
+    財務データに変更のあった銘柄のファクターを再計算してファクターテーブルに保存します。
+
+    その他の銘柄のバリュエーションも最新の株価で計算し直します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        all_codes (bool): 全銘柄を再計算する場合は True。
+    """
+    # 財務データの値を保存していない旧形式のファクターテーブルは作成し直す
+    if table_exists(conn, FACTOR_TABLE):
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({FACTOR_TABLE})")]
+        if any(col not in columns for col in VALUATION_BASES):
+            conn.execute(f"DROP TABLE {FACTOR_TABLE}")
+
+    codes = None if all_codes else changed_codes(conn)
+    if codes is not None and len(codes) == 0:
+        print("ファクターの再計算が必要な銘柄はありません。")
+    else:
+        print(f"ファクターを計算中... （対象: {'全銘柄' if codes is None else f'{len(codes)}銘柄'}）")
+        df = compute_factors(conn, codes)
+
+        # 対象銘柄のファクターを置き換える
+        if table_exists(conn, FACTOR_TABLE):
+            if codes is None:
+                conn.execute(f"DELETE FROM {FACTOR_TABLE}")
+            else:
+                conn.executemany(f"DELETE FROM {FACTOR_TABLE} WHERE コード = ?", [(code,) for code in codes])
+        df.to_sql(FACTOR_TABLE, conn, if_exists="append", index=False)
+        conn.commit()
+
+    update_valuations(conn)
+
+
+def update_valuations(conn: sqlite3.Connection) -> None:
+    """
+    ファクターテーブルの全銘柄の株価指標とバリュエーションを指標データの最新の株価で計算し直します。
+    財務データから計算するファクターは変更しません。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+    """
+    if not table_exists(conn, FACTOR_TABLE):
+        return
+
+    print("バリュエーションを更新中...")
+    df = pd.read_sql_query(f"SELECT コード, {', '.join(findata.quote_name(col) for col in VALUATION_BASES)} FROM {FACTOR_TABLE}", conn)
+    df["コード"] = df["コード"].astype(str)
+    df = valuations(df, load_prices(conn))
+
+    columns = ["株価日付"] + PRICE_COLUMNS + VALUATION_COLUMNS
+    assignments = ", ".join(f"{findata.quote_name(col)} = ?" for col in columns)
+    rows = df[columns + ["コード"]].astype(object).where(df[columns + ["コード"]].notna(), None)
+    conn.executemany(f"UPDATE {FACTOR_TABLE} SET {assignments} WHERE コード = ?", rows.itertuples(index=False, name=None))
+    conn.commit()
+
+
+def changed_codes(conn: sqlite3.Connection) -> list:
+    """
+    前回のファクター計算以降に財務データが更新された銘柄コードを返します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+
+    Returns:
+        list: 銘柄コードのリスト。ファクターテーブルがない場合は None（全銘柄）。
+    """
+    if not table_exists(conn, FACTOR_TABLE):
+        return None
+
+    factors = pd.read_sql_query(f'SELECT コード, 計算日時, "決算期（kabu+）" FROM {FACTOR_TABLE}', conn)
+
+    # Yahoo Finance の財務データが前回の計算以降に更新された銘柄
+    codes = set()
+    if table_exists(conn, findata.FETCH_TABLE):
+        fetched = pd.read_sql_query(f"SELECT コード, 更新日時 FROM {findata.FETCH_TABLE} WHERE 更新日時 IS NOT NULL", conn)
+        df = fetched.merge(factors, on="コード", how="left")
+        codes |= set(df.loc[df["計算日時"].isna() | (df["更新日時"] > df["計算日時"]), "コード"])
+
+    # 決算データ_毎月の決算期が前回の計算から進んだ銘柄
+    kabu = load_kabu(conn)
+    if kabu is not None:
+        df = kabu[["コード", "決算期（kabu+）"]].merge(factors, on="コード", how="left", suffixes=("", "_前回"))
+        codes |= set(df.loc[df["決算期（kabu+）"] > df["決算期（kabu+）_前回"].fillna(-1), "コード"])
+
+    return sorted(codes)
+
+
+def compute_factors(conn: sqlite3.Connection, codes: list = None) -> pd.DataFrame:
+    """
+    銘柄ごとのファクターを計算します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        codes (list): 計算する銘柄コード。None の場合は全銘柄。
+
+    Returns:
+        pd.DataFrame: 銘柄ごとに1行のファクターの DataFrame。
+    """
+    # Yahoo Finance の財務データを決算期ごとに横持ちで読み込む
+    fin = None
+    for table_name, data_type, items in FIN_ITEMS:
+        df = findata.load(conn, table_name, codes, items).rename(columns={to_ja[data_type][item]: item for item in items})
+        fin = df if fin is None else fin.merge(df, on=["コード", "決算期"], how="outer")
+    for item in [item for _, _, items in FIN_ITEMS for item in items]:
+        if item not in fin.columns:
+            fin[item] = np.nan
+
+    # 決算期の順に並べて前期の値を求める
+    fin = fin.sort_values(["コード", "決算期"]).reset_index(drop=True)
+    prev = fin.groupby("コード").shift(1)
+
+    # 成長率、利益率、ROE/ROA とその変化、アクルーアル
+    df = fin[["コード", "決算期"]].copy()
+    df["売上高成長率"] = growth(fin["Total Revenue"], prev["Total Revenue"])
+    df["営業利益成長率"] = growth(fin["Operating Income"], prev["Operating Income"])
+    df["純利益成長率"] = growth(fin["Net Income"], prev["Net Income"])
+    df["営業利益率"] = ratio(fin["Operating Income"], fin["Total Revenue"])
+    df["純利益率"] = ratio(fin["Net Income"], fin["Total Revenue"])
+    df["ROE"] = ratio(fin["Net Income"], fin["Stockholders Equity"])
+    df["ROA"] = ratio(fin["Net Income"], fin["Total Assets"])
+    df["ROE変化"] = df["ROE"] - ratio(prev["Net Income"], prev["Stockholders Equity"])
+    df["ROA変化"] = df["ROA"] - ratio(prev["Net Income"], prev["Total Assets"])
+    df["アクルーアル"] = ratio(fin["Net Income"] - fin["Operating Cash Flow"], fin["Total Assets"])
+    for item in ["Total Revenue", "Net Income", "Operating Cash Flow"]:
+        df[item] = fin[item]
+
+    # 銘柄ごとに最新の決算期のみ残す
+    df = df.groupby("コード").tail(1)
+
+    # 決算データ_毎月で Yahoo Finance にない値を補う
+    kabu = load_kabu(conn, codes)
+    if kabu is not None:
+        df = df.merge(kabu, on="コード", how="outer")
+        df["営業利益率"] = df["営業利益率"].fillna(ratio(df["営業利益（百万円）"], df["売上高（百万円）"]))
+        df["純利益率"] = df["純利益率"].fillna(ratio(df["当期利益（百万円）"], df["売上高（百万円）"]))
+        df["ROE"] = df["ROE"].fillna(df["ROE（kabu+）"] / 100)
+        df["ROA"] = df["ROA"].fillna(df["ROA（kabu+）"] / 100)
+        df["Total Revenue"] = df["Total Revenue"].fillna(df["売上高（百万円）"] * 1e6)
+        df["Net Income"] = df["Net Income"].fillna(df["当期利益（百万円）"] * 1e6)
+        df = df.drop(columns=["売上高（百万円）", "営業利益（百万円）", "当期利益（百万円）", "ROE（kabu+）", "ROA（kabu+）"])
+    else:
+        df["決算期（kabu+）"] = np.nan
+
+    # 指標データの最新の株価でバリュエーションを計算（株価の更新時に計算し直せるように財務データの値も残す）
+    df = df.rename(columns={item: col for col, item in VALUATION_BASES.items()})
+    df = valuations(df, load_prices(conn, codes))
+
+    df["計算日時"] = pd.Timestamp.now().isoformat(timespec="seconds")
+    return df.reset_index(drop=True)
+
+
+def valuations(df: pd.DataFrame, prices: pd.DataFrame) -> pd.DataFrame:
+    """
+    財務データの値と株価指標からバリュエーションを計算します。
+
+    Args:
+        df (pd.DataFrame): 'コード' と VALUATION_BASES の列を持つ DataFrame。
+        prices (pd.DataFrame): load_prices の戻り値。
+
+    Returns:
+        pd.DataFrame: 株価指標とバリュエーションの列を追加した DataFrame。
+    """
+    df = df.merge(prices, on="コード", how="left")
+    market_cap = df["時価総額（百万円）"] * 1e6
+    df["PSR"] = ratio(market_cap, df["売上高"])
+    df["益利回り"] = ratio(df["純利益"], market_cap)
+    df["PCFR"] = ratio(market_cap, df["営業キャッシュフロー"])
+    return df
+
+
+def load_kabu(conn: sqlite3.Connection, codes: list = None) -> pd.DataFrame:
+    """
+    決算データ_毎月から銘柄ごとに最新の月の決算データを読み込みます。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        codes (list): 読み込む銘柄コード。None の場合は全銘柄。
+
+    Returns:
+        pd.DataFrame: 銘柄ごとに1行の DataFrame。テーブルがない場合は None。
+    """
+    if not table_exists(conn, "決算データ_毎月"):
+        return None
+
+    df = pd.read_sql_query(
+        """
+        SELECT k.コード, k.決算期 AS "決算期（kabu+）", k."売上高（百万円）", k."営業利益（百万円）", k."当期利益（百万円）",
+            k.ROE AS "ROE（kabu+）", k.ROA AS "ROA（kabu+）"
+        FROM 決算データ_毎月 k
+        JOIN (SELECT コード, MAX(日付) AS 日付 FROM 決算データ_毎月 GROUP BY コード) m ON m.コード = k.コード AND m.日付 = k.日付
+        """,
+        conn,
+    )
+    df["コード"] = df["コード"].astype(str)
+    if codes is not None:
+        df = df[df["コード"].isin(codes)]
+    return df
+
+
+def load_prices(conn: sqlite3.Connection, codes: list = None) -> pd.DataFrame:
+    """
+    指標データから最新の日付の株価指標を読み込みます。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        codes (list): 読み込む銘柄コード。None の場合は全銘柄。
+
+    Returns:
+        pd.DataFrame: 'コード', '株価日付' と株価指標の列を持つ DataFrame。
+    """
+    columns = PRICE_COLUMNS
+    if not table_exists(conn, "指標データ"):
+        return pd.DataFrame(columns=["コード", "株価日付"] + columns)
+
+    query = ", ".join(findata.quote_name(col) for col in columns)
+    df = pd.read_sql_query(f"SELECT コード, 日付 AS 株価日付, {query} FROM 指標データ WHERE 日付 = (SELECT MAX(日付) FROM 指標データ)", conn)
+    df["コード"] = df["コード"].astype(str)
+    if codes is not None:
+        df = df[df["コード"].isin(codes)]
+    return df
+
+
+def growth(current: pd.Series, previous: pd.Series) -> pd.Series:
+    """
+    前期比の成長率を返します。前期の値が0以下の場合は NaN とします。
+    """
+    return (current - previous) / previous.where(previous > 0)
+
+
+def ratio(numerator: pd.Series, denominator: pd.Series) -> pd.Series:
+    """
+    比率を返します。分母が0の場合は NaN とします。
+    """
+    return numerator / denominator.replace(0, np.nan)
+
+
+def table_exists(conn: sqlite3.Connection, table_name: str) -> bool:
+    """
+    テーブルまたはビューが存在するかを返します。
+    """
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?", (table_name,)).fetchone() is not None
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1 and sys.argv[1] == "update":
+        conn = sqlite3.connect("db.sqlite3")
+        try:
+            findata.create_tables(conn)
+            update_factors(conn, all_codes=len(sys.argv) > 2 and sys.argv[2] == "all")
+        finally:
+            conn.close()
+        print("ファクターの更新が完了しました。")
+    else:
+        print("usage: python factor.py update [all]")
@@ -0,0 +1,345 @@
+import sqlite3
+import pandas as pd
+import en2ja
+
+"""
+Yahoo Finance の財務データを縦持ち（表ID, コード, 決算期, 項目ID, 値）で保存する。
+表名は財務表テーブルで整数の表IDに、項目名は en2ja.to_ja から作成する財務項目テーブルで整数の項目IDに変換する。
+横持ちの 財務諸表_FIN などは縦持ちテーブルのビューとして作成する。
+"""
+
+to_ja = en2ja.to_ja
+
+# 縦持ちの財務データテーブル
+FIN_TABLE = "財務データ"
+
+# 財務項目の辞書テーブル
+ITEM_TABLE = "財務項目"
+
+# 表名（横持ちビューの名前）の辞書テーブル
+STATEMENT_TABLE = "財務表"
+
+# 銘柄ごとの取得履歴テーブル
+FETCH_TABLE = "財務取得履歴"
+
+# 横持ちビューの名前とデータ種別
+VIEW_TYPES = {
+    "財務諸表_FIN": "fin",
+    "賃借対照表_BS": "bs",
+    "損益計算書_PL": "pl",
+    "キャッシュフロー計算書_CF": "cf",
+    "財務諸表_FINQTY": "fin",
+    "賃借対照表_BSQTY": "bs",
+    "損益計算書_PLQTY": "pl",
+    "キャッシュフロー計算書_CFQTY": "cf",
+}
+
+
+def create_tables(conn: sqlite3.Connection) -> None:
+    """
+    財務項目テーブル、財務表テーブル、縦持ちの財務データテーブルと取得履歴テーブルを作成します。
+    財務項目テーブルには en2ja.to_ja の項目を、財務表テーブルには VIEW_TYPES の表名を登録します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+    """
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {ITEM_TABLE} (
+            項目ID INTEGER PRIMARY KEY,
+            種別 TEXT NOT NULL,
+            英語名 TEXT NOT NULL,
+            日本語名 TEXT,
+            UNIQUE (種別, 英語名)
+        )
+        """
+    )
+
+    # 日本語変換辞書の項目を登録
+    conn.executemany(
+        f"""
+        INSERT INTO {ITEM_TABLE} (種別, 英語名, 日本語名) VALUES (?, ?, ?)
+        ON CONFLICT (種別, 英語名) DO UPDATE SET 日本語名 = excluded.日本語名
+        WHERE 日本語名 IS NOT excluded.日本語名
+        """,
+        [(data_type, en, ja) for data_type, my_to_ja in to_ja.items() for en, ja in my_to_ja.items()],
+    )
+
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {STATEMENT_TABLE} (
+            表ID INTEGER PRIMARY KEY,
+            表名 TEXT NOT NULL UNIQUE
+        )
+        """
+    )
+    conn.executemany(f"INSERT OR IGNORE INTO {STATEMENT_TABLE} (表名) VALUES (?)", [(table_name,) for table_name in VIEW_TYPES])
+
+    # 項目名・表名を文字列で持つ旧形式のテーブルは項目ID・表IDに移行する
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({FIN_TABLE})")]
+    if "項目" in columns or "表名" in columns:
+        migrate_items(conn, columns)
+
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {FIN_TABLE} (
+            表ID INTEGER NOT NULL REFERENCES {STATEMENT_TABLE} (表ID),
+            コード TEXT NOT NULL,
+            決算期 TEXT NOT NULL,
+            項目ID INTEGER NOT NULL REFERENCES {ITEM_TABLE} (項目ID),
+            値 REAL,
+            PRIMARY KEY (表ID, コード, 決算期, 項目ID)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{FIN_TABLE}_コード ON {FIN_TABLE} (コード, 決算期)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{FIN_TABLE}_項目ID ON {FIN_TABLE} (項目ID, 決算期)")
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {FETCH_TABLE} (
+            コード TEXT PRIMARY KEY,
+            取得日時 TEXT,
+            更新日時 TEXT
+        )
+        """
+    )
+    conn.commit()
+
+    # 横持ちのテーブルで保存していた旧形式の財務データは縦持ちに移行する
+    for table_name, data_type in VIEW_TYPES.items():
+        kind = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (table_name,)).fetchone()
+        if kind is not None and kind[0] == "table":
+            migrate_table(conn, table_name, data_type)
+
+
+def migrate_table(conn: sqlite3.Connection, table_name: str, data_type: str) -> None:
+    """
+    横持ちのテーブルで保存していた旧形式の財務データを縦持ちの財務データテーブルに移し、旧テーブルを削除します。
+    列名は日本語名（辞書にない項目は英語名）のため、en2ja.to_ja の逆引きで英語名に戻します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        table_name (str): 旧形式のテーブル名（財務諸表_FIN など）。
+        data_type (str): データ種別。
+    """
+    print(f"{table_name} を縦持ちの形式に移行中...")
+    df = pd.read_sql_query(f"SELECT * FROM {table_name}", conn)
+
+    # 日本語名から英語名への辞書（同じ日本語名の英語名が複数ある場合は先頭の英語名）
+    to_en = {}
+    for en, ja in to_ja.get(data_type, {}).items():
+        to_en.setdefault(ja, en)
+
+    df = df.melt(id_vars=["コード", "決算期"], var_name="項目", value_name="値")
+    df["項目"] = df["項目"].map(lambda name: to_en.get(name, name))
+    df["決算期"] = pd.to_datetime(df["決算期"]).dt.date
+
+    upsert(conn, df, table_name, data_type)
+    conn.execute(f"DROP TABLE {table_name}")
+    conn.commit()
+
+
+def migrate_items(conn: sqlite3.Connection, columns: list) -> None:
+    """
+    項目名・表名を文字列で持つ旧形式の財務データテーブルを項目ID・表IDの形式に移行します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        columns (list): 旧形式のテーブルの列名。
+    """
+    print(f"{FIN_TABLE} を項目ID・表IDの形式に移行中...")
+    conn.execute(f"DROP INDEX IF EXISTS idx_{FIN_TABLE}_コード")
+    conn.execute(f"DROP INDEX IF EXISTS idx_{FIN_TABLE}_項目")
+    conn.execute(f"DROP INDEX IF EXISTS idx_{FIN_TABLE}_項目ID")
+    conn.execute(f"ALTER TABLE {FIN_TABLE} RENAME TO {FIN_TABLE}_旧")
+    create_tables(conn)
+
+    # 表名ごとのデータ種別で項目IDに変換して移し替える
+    old = f"{FIN_TABLE}_旧"
+    for table_name, data_type in VIEW_TYPES.items():
+        table_id = get_table_id(conn, table_name)
+        if "項目" in columns:
+            items = [row[0] for row in conn.execute(f"SELECT DISTINCT 項目 FROM {old} WHERE 表名 = ?", (table_name,))]
+            get_item_ids(conn, data_type, items)
+            select = f"SELECT ?, o.コード, o.決算期, i.項目ID, o.値 FROM {old} o JOIN {ITEM_TABLE} i ON i.種別 = ? AND i.英語名 = o.項目 WHERE o.表名 = ?"
+            params = (table_id, data_type, table_name)
+        else:
+            select = f"SELECT ?, コード, 決算期, 項目ID, 値 FROM {old} WHERE 表名 = ?"
+            params = (table_id, table_name)
+        conn.execute(f"INSERT OR REPLACE INTO {FIN_TABLE} (表ID, コード, 決算期, 項目ID, 値) {select}", params)
+    conn.execute(f"DROP TABLE {old}")
+    conn.commit()
+
+
+def get_table_id(conn: sqlite3.Connection, table_name: str) -> int:
+    """
+    表名（横持ちビューの名前）の表IDを返します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        table_name (str): 表名。
+
+    Returns:
+        int: 表ID。
+    """
+    return conn.execute(f"SELECT 表ID FROM {STATEMENT_TABLE} WHERE 表名 = ?", (table_name,)).fetchone()[0]
+
+
+def get_item_ids(conn: sqlite3.Connection, data_type: str, items: list) -> dict:
+    """
+    項目名（英語）から項目IDへの辞書を返します。未登録の項目は財務項目テーブルに追加します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        data_type (str): データ種別。
+        items (list): 項目名（英語）のリスト。
+
+    Returns:
+        dict: 項目名（英語）をキー、項目IDを値とする辞書。
+    """
+    ids = dict(conn.execute(f"SELECT 英語名, 項目ID FROM {ITEM_TABLE} WHERE 種別 = ?", (data_type,)).fetchall())
+
+    # 辞書にない項目名をログに出力して追加
+    for item in set(items) - set(ids):
+        print(f"未登録の列名: {item} （データ種別: {data_type}）")
+        ids[item] = conn.execute(f"INSERT INTO {ITEM_TABLE} (種別, 英語名) VALUES (?, ?)", (data_type, item)).lastrowid
+
+    return ids
+
+
+def upsert(conn: sqlite3.Connection, df: pd.DataFrame, table_name: str, data_type: str) -> int:
+    """
+    縦持ちの財務データを追加・更新します。値が変わっていない行は書き込みません。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        df (pd.DataFrame): 'コード', '決算期', '項目', '値' 列を持つ DataFrame。項目は英語名。
+        table_name (str): 横持ちビューの名前（財務諸表_FIN など）。
+        data_type (str): データ種別。項目IDの変換に使用します。
+
+    Returns:
+        int: 追加・更新した行数。
+    """
+    if df is None or df.empty:
+        return 0
+
+    # 値がない行は保存しない
+    df = df.dropna(subset=["値"])
+
+    # 項目名を項目IDに変換
+    ids = get_item_ids(conn, data_type, df["項目"].astype(str).unique())
+
+    rows = zip(
+        [get_table_id(conn, table_name)] * len(df),
+        df["コード"].astype(str),
+        df["決算期"].astype(str),
+        df["項目"].astype(str).map(ids).astype(int),
+        df["値"].astype(float),
+    )
+
+    # 変更のあった行のみ書き込む
+    before = conn.total_changes
+    conn.executemany(
+        f"""
+        INSERT INTO {FIN_TABLE} (表ID, コード, 決算期, 項目ID, 値) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (表ID, コード, 決算期, 項目ID) DO UPDATE SET 値 = excluded.値
+        WHERE 値 IS NOT excluded.値
+        """,
+        rows,
+    )
+    return conn.total_changes - before
+
+
+def record_fetch(conn: sqlite3.Connection, code: str, changed: bool) -> None:
+    """
+    銘柄の取得日時を記録します。データに変更があった場合は更新日時も記録します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        code (str): 銘柄コード。
+        changed (bool): データに変更があった場合は True。
+    """
+    now = pd.Timestamp.now().isoformat(timespec="seconds")
+    conn.execute(
+        f"""
+        INSERT INTO {FETCH_TABLE} (コード, 取得日時, 更新日時) VALUES (?, ?, ?)
+        ON CONFLICT (コード) DO UPDATE SET
+            取得日時 = excluded.取得日時,
+            更新日時 = CASE WHEN ? THEN excluded.更新日時 ELSE 更新日時 END
+        """,
+        (code, now, now if changed else None, changed),
+    )
+
+
+def create_view(conn: sqlite3.Connection, table_name: str, data_type: str) -> None:
+    """
+    縦持ちの財務データから横持ちのビューを作成します。列名は財務項目テーブルの日本語名にします。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        table_name (str): 作成するビューの名前。
+        data_type (str): データ種別。
+    """
+
+    # ビューに含める項目を取得
+    table_id = get_table_id(conn, table_name)
+    items = conn.execute(
+        f"""
+        SELECT i.項目ID, COALESCE(i.日本語名, i.英語名) FROM {ITEM_TABLE} i
+        WHERE i.種別 = ? AND EXISTS (SELECT 1 FROM {FIN_TABLE} f WHERE f.項目ID = i.項目ID AND f.表ID = ?)
+        ORDER BY i.項目ID
+        """,
+        (data_type, table_id),
+    ).fetchall()
+
+    # 項目ごとに列を作成
+    columns = ",\n".join(f"MAX(CASE WHEN 項目ID = {item_id} THEN 値 END) AS {quote_name(name)}" for item_id, name in items)
+    select = f"SELECT コード, 決算期{',' if columns else ''}\n{columns}\nFROM {FIN_TABLE} WHERE 表ID = {table_id}\nGROUP BY コード, 決算期"
+
+    # 旧来の横持ちテーブルまたはビューを置き換える
+    kind = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (table_name,)).fetchone()
+    if kind is not None:
+        conn.execute(f"DROP {kind[0].upper()} {table_name}")
+    conn.execute(f"CREATE VIEW {table_name} AS {select}")
+    conn.commit()
+
+
+def load(conn: sqlite3.Connection, table_name: str, codes: list = None, items: list = None) -> pd.DataFrame:
+    """
+    縦持ちの財務データを読み込み、横持ちに変換して返します。列名は財務項目テーブルの日本語名にします。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        table_name (str): 横持ちビューの名前（財務諸表_FIN など）。
+        codes (list): 読み込む銘柄コード。None の場合は全銘柄。
+        items (list): 読み込む項目名（英語）。None の場合は全項目。
+
+    Returns:
+        pd.DataFrame: 'コード', '決算期' と各項目の列を持つ DataFrame。
+    """
+    data_type = VIEW_TYPES[table_name]
+    names = pd.read_sql_query(f"SELECT 項目ID, 英語名, COALESCE(日本語名, 英語名) AS 名前 FROM {ITEM_TABLE} WHERE 種別 = ?", conn, params=[data_type])
+
+    query = f"SELECT コード, 決算期, 項目ID, 値 FROM {FIN_TABLE} WHERE 表ID = ?"
+    params = [get_table_id(conn, table_name)]
+    if codes is not None:
+        query += f" AND コード IN ({','.join('?' * len(codes))})"
+        params += [str(code) for code in codes]
+    if items is not None:
+        # 項目の絞り込みは項目IDの整数比較で行う
+        item_ids = names.loc[names["英語名"].isin(items), "項目ID"].tolist()
+        query += f" AND 項目ID IN ({','.join('?' * len(item_ids))})"
+        params += item_ids
+    df = pd.read_sql_query(query, conn, params=params)
+    if df.empty:
+        return pd.DataFrame(columns=["コード", "決算期"])
+
+    # 横持ちに変換して列名を日本語に変換
+    df = df.pivot_table(index=["コード", "決算期"], columns="項目ID", values="値").reset_index()
+    df.columns.name = None
+    return df.rename(columns=dict(zip(names["項目ID"], names["名前"])))
+
+
+def quote_name(name: str) -> str:
+    """SQL の識別子に変換します。"""
+    return '"' + str(name).replace('"', '""') + '"'
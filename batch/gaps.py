@@ -0,0 +1,232 @@
+import sys
+import sqlite3
+import datetime
+import numpy as np
+import pandas as pd
+import jpx
+import rollup
+import archive
+
+"""
+日次のテーブルの（コード, 日付）の欠損を検出し、欠損だけを取得し直すための修復計画を作成する。
+営業日は保存済みのデータによらず、平日から国民の祝日・休日と取引所の休業日（12/31〜1/3）を除いた日とする。
+（保存済みのデータから営業日を求めると、全テーブルの取得に失敗した日を欠損として検出できないため）
+銘柄ごとの開始日は銘柄マスタの上場日（列がない場合は最初にデータのある日）とする。
+"""
+
+# 営業日の期間（最初と最後の日）を求めるテーブル
+CALENDAR_TABLES = ["株価データ", "指標データ", "指数データ"]
+
+# 規則で求められない休日（祝日の移動、即位関連の休日など）。今後の臨時の休業日もここに追加する
+EXTRA_HOLIDAYS = [
+    "2019-04-30",
+    "2019-05-01",
+    "2019-05-02",
+    "2019-10-22",
+    "2020-07-23",
+    "2020-07-24",
+    "2020-08-10",
+    "2021-07-22",
+    "2021-07-23",
+    "2021-08-09",
+]
+
+# 特措法で移動したため規則による日付が平日となった祝日
+MOVED_HOLIDAYS = ["2020-07-20", "2020-08-11", "2020-10-12", "2021-07-19", "2021-08-11", "2021-10-11"]
+
+
+def nth_monday(year: int, month: int, n: int) -> datetime.date:
+    """
+    月の第 n 月曜日を返します。
+    """
+    first = datetime.date(year, month, 1)
+    return first + datetime.timedelta(days=(7 - first.weekday()) % 7 + 7 * (n - 1))
+
+
+def holidays(year: int) -> set:
+    """
+    国民の祝日、振替休日、国民の休日と取引所の休業日（12/31〜1/3）を返します。
+
+    Args:
+        year (int): 年。
+
+    Returns:
+        set: 休日の datetime.date の集合。
+    """
+    date = datetime.date
+    days = {
+        date(year, 1, 1),
+        nth_monday(year, 1, 2),
+        date(year, 2, 11),
+        date(year, 3, int(20.8431 + 0.242194 * (year - 1980) - (year - 1980) // 4)),
+        date(year, 4, 29),
+        date(year, 5, 3),
+        date(year, 5, 4),
+        date(year, 5, 5),
+        nth_monday(year, 7, 3),
+        date(year, 8, 11),
+        nth_monday(year, 9, 3),
+        date(year, 9, int(23.2488 + 0.242194 * (year - 1980) - (year - 1980) // 4)),
+        nth_monday(year, 10, 2),
+        date(year, 11, 3),
+        date(year, 11, 23),
+    }
+
+    # 天皇誕生日（2019年はなし）
+    if year <= 2018:
+        days.add(date(year, 12, 23))
+    elif year >= 2020:
+        days.add(date(year, 2, 23))
+
+    days -= {pd.Timestamp(day).date() for day in MOVED_HOLIDAYS}
+    days |= {pd.Timestamp(day).date() for day in EXTRA_HOLIDAYS if pd.Timestamp(day).year == year}
+
+    # 振替休日（日曜日の祝日の後の最初の祝日でない日）
+    for day in sorted(days):
+        if day.weekday() == 6:
+            substitute = day + datetime.timedelta(days=1)
+            while substitute in days:
+                substitute += datetime.timedelta(days=1)
+            days.add(substitute)
+
+    # 国民の休日（前日と翌日が祝日の日）
+    for day in sorted(days):
+        between = day + datetime.timedelta(days=1)
+        if between not in days and between + datetime.timedelta(days=1) in days and between.weekday() != 6:
+            days.add(between)
+
+    # 取引所の休業日
+    days |= {date(year, 1, 2), date(year, 1, 3), date(year, 12, 31)}
+    return days
+
+
+def trading_calendar(conn: sqlite3.Connection, start: pd.Timestamp = None) -> np.ndarray:
+    """
+    平日から休日を除いた日を営業日として返します。期間は開始日（None の場合は日次のテーブルの最初の日）から
+    日次のテーブルの最後の日までとします。アーカイブ済みの年も含めます。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        start (pd.Timestamp): 開始日。None の場合は最初から。
+
+    Returns:
+        np.ndarray: 営業日の datetime64 の配列（昇順）。
+    """
+    first, last = [], []
+    for table_name in CALENDAR_TABLES:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table_name,)).fetchone():
+            # アーカイブDBごと、メインのDBの最初と最後の日
+            for df in archive.iter_read(conn, table_name, f"MIN({rollup.DATE_KEY}) AS 最初, MAX({rollup.DATE_KEY}) AS 最後", start):
+                for row in df.dropna().itertuples(index=False):
+                    first.append(pd.Timestamp(str(row.最初)))
+                    last.append(pd.Timestamp(str(row.最後)))
+    if not last:
+        return np.array([], dtype="datetime64[ns]")
+
+    start = pd.Timestamp(start).normalize() if start is not None else min(first)
+    days = pd.bdate_range(start, max(last))
+    closed = set().union(*[holidays(year) for year in range(start.year, max(last).year + 1)])
+    return days[~days.isin(pd.DatetimeIndex(sorted(closed)))].to_numpy()
+
+
+def scan(conn: sqlite3.Connection, table_name: str, stocks: pd.DataFrame = None, start: pd.Timestamp = None) -> pd.DataFrame:
+    """
+    テーブルの（コード, 日付）の欠損を検出します。
+    銘柄×営業日の行列で、開始日以降の営業日にデータのない位置を一度に求めます。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        table_name (str): テーブル名。
+        stocks (pd.DataFrame): 銘柄マスタ。None の場合はテーブルにある銘柄のみ対象とします。
+        start (pd.Timestamp): 開始日。None の場合は最初から。
+
+    Returns:
+        pd.DataFrame: 欠損している 'コード', '日付' の DataFrame。
+    """
+    calendar = trading_calendar(conn, start)
+
+    # 開始日以降の行をアーカイブ済みの年も含めて読み込む
+    df = pd.concat(archive.iter_read(conn, table_name, "DISTINCT コード, 日付", start), ignore_index=True)
+    df["コード"] = df["コード"].astype(str)
+    df["日付"] = rollup.parse_dates(df["日付"])
+
+    # 対象の銘柄（銘柄マスタにある銘柄とテーブルにある銘柄）
+    listed = [] if stocks is None else stocks["コード"].astype(str).tolist()
+    codes = np.array(sorted(set(listed) | set(df["コード"])))
+
+    # 銘柄×営業日のデータの有無の行列
+    df = df[df["日付"].isin(calendar)]
+    present = np.zeros((len(calendar), len(codes)), dtype=bool)
+    present[np.searchsorted(calendar, df["日付"].to_numpy()), np.searchsorted(codes, df["コード"].to_numpy())] = True
+
+    # 銘柄ごとの開始日（上場日、なければ最初にデータのある日、データがなければ最初の営業日）
+    first = df.groupby("コード")["日付"].min().reindex(codes)
+    if stocks is not None and "上場日" in stocks.columns:
+        listing = pd.to_datetime(stocks.set_index(stocks["コード"].astype(str))["上場日"], errors="coerce")
+        first = listing.reindex(codes).fillna(first)
+    first = first.fillna(pd.Timestamp(calendar[0]) if len(calendar) > 0 else pd.NaT).to_numpy()
+
+    # 銘柄マスタにない銘柄（上場廃止など）は最後にデータのある日まで
+    last = df.groupby("コード")["日付"].max().reindex(codes)
+    last[np.isin(codes, listed)] = pd.Timestamp(calendar[-1]) if len(calendar) > 0 else pd.NaT
+    last = last.to_numpy()
+
+    expected = (calendar[:, None] >= first[None, :]) & (calendar[:, None] <= last[None, :])
+    date_index, code_index = np.nonzero(expected & ~present)
+    return pd.DataFrame({"コード": codes[code_index], "日付": calendar[date_index]}).sort_values(["コード", "日付"], ignore_index=True)
+
+
+def plan_ranges(conn: sqlite3.Connection, missing: pd.DataFrame, start: pd.Timestamp = None) -> pd.DataFrame:
+    """
+    欠損を銘柄ごとの連続した営業日の範囲にまとめた修復計画を返します。銘柄ごとに取得する場合に使用します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        missing (pd.DataFrame): scan の戻り値。
+        start (pd.Timestamp): scan に指定した開始日。
+
+    Returns:
+        pd.DataFrame: 'コード', '開始日', '終了日', '日数' の DataFrame。
+    """
+    if missing.empty:
+        return pd.DataFrame(columns=["コード", "開始日", "終了日", "日数"])
+
+    # 営業日の位置が連続しない、または銘柄が変わる位置で範囲を分ける
+    calendar = trading_calendar(conn, start)
+    position = np.searchsorted(calendar, missing["日付"].to_numpy())
+    codes = missing["コード"].to_numpy()
+    breaks = np.ones(len(missing), dtype=bool)
+    breaks[1:] = (codes[1:] != codes[:-1]) | (np.diff(position) != 1)
+
+    df = missing.assign(範囲=np.cumsum(breaks))
+    df = df.groupby("範囲").agg(コード=("コード", "first"), 開始日=("日付", "min"), 終了日=("日付", "max"), 日数=("日付", "size"))
+    return df.reset_index(drop=True)
+
+
+def plan_dates(missing: pd.DataFrame) -> pd.DataFrame:
+    """
+    欠損を日付ごとにまとめた修復計画を返します。日付ごとに全銘柄のファイルを取得する場合に使用します。
+
+    Args:
+        missing (pd.DataFrame): scan の戻り値。
+
+    Returns:
+        pd.DataFrame: '日付', 'コード'（欠損している銘柄コードのリスト）の DataFrame。
+    """
+    return missing.groupby("日付")["コード"].agg(list).reset_index()
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 2 and sys.argv[1] == "scan":
+        table_name = sys.argv[2]
+        conn = sqlite3.connect("db.sqlite3")
+        try:
+            stocks = jpx.load() if table_name != "指数データ" else None
+            missing = scan(conn, table_name, stocks)
+            print(f"欠損: {len(missing)}件")
+            print(plan_ranges(conn, missing).to_string())
+        finally:
+            conn.close()
+    else:
+        print("usage: python gaps.py scan テーブル名")
@@ -0,0 +1,219 @@
+import sys
+import sqlite3
+import numpy as np
+import pandas as pd
+import jpx
+import rollup
+import archive
+import colstore
+
+"""
+銘柄マスタの分類（市場・商品区分、33業種区分、17業種区分）と指数バスケットテーブルの銘柄で
+時価総額加重・等金額の指数を計算し、指数データと同じ形式で自作指数データに保存する。
+指数の日次リターンは銘柄×分類の行列の積でまとめて計算し、初回は全期間、以降は最終日付の翌日から追加する。
+過去の株価データ・指標データを修復した場合は、修復した日付以降を計算し直す。
+"""
+
+# 自作指数のテーブル
+INDEX_TABLE = "自作指数データ"
+
+# 自作のバスケット（指数名, コード）のテーブル
+BASKET_TABLE = "指数バスケット"
+
+# 分類に使用する銘柄マスタの列
+GROUP_COLUMNS = {"市場": "市場・商品区分", "33業種": "33業種区分", "17業種": "17業種区分"}
+
+# 加重方法（コードの接頭辞, 指数名の接尾辞）
+WEIGHTINGS = [("CAP", "時価総額加重"), ("EQ", "等金額")]
+
+# 指数の基準値
+BASE_VALUE = 1000.0
+
+# 株式分割・併合とみなす発行済株式数の前日比の変化率（増資・自己株式の消却などの小さい変化は調整しない）
+SPLIT_THRESHOLD = 0.05
+
+
+def groups(conn: sqlite3.Connection, stocks: pd.DataFrame) -> pd.DataFrame:
+    """
+    銘柄と分類の対応表を返します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        stocks (pd.DataFrame): 銘柄マスタ。
+
+    Returns:
+        pd.DataFrame: '分類', 'コード' の DataFrame。分類は「市場-プライム」「33業種-電気機器」などの形式。
+    """
+    frames = []
+    for prefix, column in GROUP_COLUMNS.items():
+        if column in stocks.columns:
+            df = stocks[["コード", column]].dropna()
+            frames.append(pd.DataFrame({"分類": prefix + "-" + df[column].astype(str), "コード": df["コード"].astype(str)}))
+
+    # 指数バスケットテーブルがあれば自作のバスケットも追加
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (BASKET_TABLE,)).fetchone():
+        df = pd.read_sql_query(f"SELECT 指数名, コード FROM {BASKET_TABLE}", conn)
+        frames.append(pd.DataFrame({"分類": "バスケット-" + df["指数名"].astype(str), "コード": df["コード"].astype(str)}))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_matrices(conn: sqlite3.Connection, codes: list, start: pd.Timestamp = None) -> tuple:
+    """
+    終値、時価総額と発行済株式数を日付×コードの行列で読み込みます。時価総額と発行済株式数は直近の値で埋めます。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        codes (list): 銘柄コード。
+        start (pd.Timestamp): 開始日。None の場合は最初から。
+
+    Returns:
+        tuple: 終値、時価総額（百万円）、発行済株式数の DataFrame。
+    """
+    store = colstore.open_store()
+    if store is not None:
+        close = colstore.matrix(store, "終値", codes, start)
+    else:
+        df = archive.read(conn, "株価データ", "コード, 日付, 終値", start=start)
+        df["コード"] = df["コード"].astype(str)
+        df = df[df["コード"].isin(codes)]
+        df["日付"] = rollup.parse_dates(df["日付"])
+        close = df.pivot_table(index="日付", columns="コード", values="終値")
+
+    df = archive.read(conn, "指標データ", 'コード, 日付, "時価総額（百万円）" AS 時価総額, 発行済株式数', start=start)
+    df["コード"] = df["コード"].astype(str)
+    df["日付"] = rollup.parse_dates(df["日付"])
+
+    matrices = []
+    for col in ["時価総額", "発行済株式数"]:
+        matrix = df.pivot_table(index="日付", columns="コード", values=col).reindex(columns=close.columns)
+        matrices.append(matrix.reindex(matrix.index.union(close.index)).ffill().reindex(close.index))
+    return close, *matrices
+
+
+def compute(close: pd.DataFrame, cap: pd.DataFrame, members: pd.DataFrame, shares: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    分類ごとの時価総額加重・等金額の日次リターンを計算します。
+    前日の時価総額をウェイトとし、前日と当日の終値がある銘柄のみ対象とします。
+    終値は分割調整されていないため、発行済株式数が SPLIT_THRESHOLD 以上変化した銘柄は株式数の比でリターンを調整します。
+
+    Args:
+        close (pd.DataFrame): 終値の行列。
+        cap (pd.DataFrame): 時価総額の行列。
+        members (pd.DataFrame): groups の戻り値。
+        shares (pd.DataFrame): 発行済株式数の行列。None の場合は調整しません。
+
+    Returns:
+        pd.DataFrame: 日付をインデックス、（加重方法, 分類）を列とする日次リターンの DataFrame。
+    """
+    # 銘柄×分類の所属行列
+    names = np.array(sorted(members["分類"].unique()))
+    membership = np.zeros((len(close.columns), len(names)))
+    members = members[members["コード"].isin(close.columns)]
+    membership[close.columns.get_indexer(members["コード"]), np.searchsorted(names, members["分類"])] = 1
+
+    # 株式分割・併合による発行済株式数の比（分割の場合は 2 など）
+    values = close.to_numpy(dtype=float)
+    factor = np.ones((max(len(values) - 1, 0), len(close.columns)))
+    if shares is not None:
+        count = shares.to_numpy(dtype=float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ratio = count[1:] / count[:-1]
+        factor = np.where(np.isfinite(ratio) & (np.abs(ratio - 1) >= SPLIT_THRESHOLD), ratio, 1.0)
+
+    # 分割調整した日次リターンと前日の時価総額
+    returns = values[1:] * factor / values[:-1] - 1
+    valid = np.isfinite(returns)
+    returns = np.where(valid, returns, 0.0)
+    weights = np.where(valid, np.nan_to_num(cap.to_numpy(dtype=float)[:-1]), 0.0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cap_weighted = ((weights * returns) @ membership) / (weights @ membership)
+        equal_weighted = ((valid * returns) @ membership) / (valid @ membership)
+
+    columns = pd.MultiIndex.from_product([[prefix for prefix, _ in WEIGHTINGS], names])
+    return pd.DataFrame(np.hstack([cap_weighted, equal_weighted]), index=close.index[1:], columns=columns)
+
+
+def update_indices(conn: sqlite3.Connection, stocks: pd.DataFrame, since: pd.Timestamp = None) -> None:
+    """
+    自作指数を計算して自作指数データに追加します。初回は全期間、以降は最終日付の翌日から追加します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        stocks (pd.DataFrame): 銘柄マスタ。
+        since (pd.Timestamp): この日付以降を計算し直します。None の場合は最終日付の翌日から追加します。
+    """
+    print(f"{INDEX_TABLE} を更新中...")
+    members = groups(conn, stocks)
+
+    # 既存の指数の最終日付と最終値（計算し直す場合は since より前の最終日付と値）
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (INDEX_TABLE,)).fetchone() is not None
+    last = None
+    if exists:
+        condition, params = ("WHERE 日付 < ?", [pd.Timestamp(since).strftime("%Y-%m-%d")]) if since is not None else ("", [])
+        query = f"SELECT コード, 日付, 終値 FROM {INDEX_TABLE} WHERE 日付 = (SELECT MAX(日付) FROM {INDEX_TABLE} {condition})"
+        last = pd.read_sql_query(query, conn, params=params)
+    start = pd.to_datetime(last["日付"].iloc[0]) if last is not None and not last.empty else None
+
+    # 最終日付の前から読み込み、最終日付の翌日以降のリターンを計算する
+    close, cap, shares = load_matrices(conn, members["コード"].unique().tolist(), start - pd.Timedelta(days=10) if start is not None else None)
+    returns = compute(close, cap, members, shares)
+    if start is not None:
+        returns = returns[returns.index > start]
+    if returns.empty:
+        return
+
+    frames = []
+    for prefix, suffix in WEIGHTINGS:
+        daily = returns[prefix]
+
+        # 最終値から連結する（新しい分類は基準値から）
+        base = pd.Series(BASE_VALUE, index=daily.columns)
+        if start is not None:
+            previous = last.set_index("コード")["終値"]
+            base = previous.reindex([f"{prefix}-{name}" for name in daily.columns]).set_axis(daily.columns).fillna(BASE_VALUE)
+        levels = (1 + daily.fillna(0)).cumprod() * base
+
+        # 初回は最初の日付を基準値とする
+        if start is None:
+            levels = pd.concat([pd.DataFrame([base], index=close.index[:1]), levels])
+
+        df = levels.reset_index(names="日付").melt(id_vars="日付", var_name="分類", value_name="終値")
+        df["コード"] = prefix + "-" + df["分類"]
+        df["指数名"] = df["分類"] + "（" + suffix + "）"
+        frames.append(df)
+
+    df = pd.concat(frames, ignore_index=True)
+    df["日付"] = df["日付"].dt.strftime("%Y-%m-%d")
+
+    # 計算し直した日付以降の既存の行を置き換える
+    if since is not None and exists:
+        if start is not None:
+            conn.execute(f"DELETE FROM {INDEX_TABLE} WHERE 日付 > ?", (start.strftime("%Y-%m-%d"),))
+        else:
+            conn.execute(f"DELETE FROM {INDEX_TABLE}")
+    df[["コード", "指数名", "日付", "終値"]].to_sql(INDEX_TABLE, conn, if_exists="append", index=False)
+    conn.commit()
+
+    # 週足・月足を更新
+    rollup.update_rollups(conn, INDEX_TABLE, since=since)
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1 and sys.argv[1] in ["update", "rebuild"]:
+        print("JPX銘柄一覧を読み込み中...")
+        stocks = jpx.load()
+
+        conn = sqlite3.connect("db.sqlite3")
+        try:
+            if sys.argv[1] == "rebuild":
+                for table_name in [INDEX_TABLE] + [f"{INDEX_TABLE}_{suffix}" for suffix, _ in rollup.RESOLUTIONS]:
+                    conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+            update_indices(conn, stocks)
+        finally:
+            conn.close()
+        print("自作指数の更新が完了しました。")
+    else:
+        print("usage: python indices.py update|rebuild")
@@ -1,6 +1,7 @@
 import sys
 import pandas as pd
 import sqlite3
+import search
 
 # JPXの東証上場銘柄一覧
 JPX_DATA_URL = "https://www.jpx.co.jp/markets/statistics-equities/misc/tvdivq0000001vg2-att/data_j.xls"
@@ -34,6 +35,9 @@ def download_jpx_data() -> pd.DataFrame:
     conn = sqlite3.connect("db.sqlite3")
     try:
         df.to_sql("銘柄マスタ", conn, if_exists="replace", index=False)
+
+        # 銘柄マスタが変わったので銘柄検索の索引も作成し直す
+        search.build_index(conn)
     finally:
         conn.close()
 
@@ -2,10 +2,17 @@ import sys
 import io
 from pathlib import Path
 import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import requests
 import pandas as pd
 import myenv
 import batch.jpx as jpx
+import batch.rollup as rollup
+import batch.colstore as colstore
+import batch.gaps as gaps
+import batch.indices as indices
+import batch.factor as factor
 
 """
 以下のデータをkabu+から取得してSQLiteに保存する。
@@ -17,6 +24,15 @@ https://csvex.com/kabu.plus/csv/japan-all-stock-financial-results/monthly/ 決
 
 CSVEX_URL = "https://csvex.com/kabu.plus/csv/{path}/{frequency}/{path}_{symbol}.csv"
 
+# CSVの変換（Shift-JISのデコードと整形）を行うプロセス数（None の場合は CPU 数）
+TRANSFORM_PROCESSES = None
+
+# ダウンロード済みで変換・書き込みを待っているファイルの上限（メモリ使用量の上限になる）
+MAX_IN_FLIGHT = 8
+
+# ワーカープロセスで共有する銘柄マスタ（コードのみ）
+_stocks = None
+
 
 # -- データを更新する関数 --#
 def update_data(stocks: pd.DataFrame, path: str, table_name: str, frequency: str) -> None:
@@ -51,32 +67,119 @@ def update_data(stocks: pd.DataFrame, path: str, table_name: str, frequency: str
         else:
             raise NotImplementedError(f"{frequency} の頻度は未実装です")
 
-    # 日付を１日ずつ進めてデータを取得してテーブルに追加する
-    while True:
-        # 取得する日付のシンボルを作成
-        symbol = mydate.strftime("%Y%m%d")
+    # 日付を１日ずつ進めて今日までのデータを取得する
+    symbols = [date.strftime("%Y%m%d") for date in pd.date_range(mydate, pd.to_datetime("today"))]
 
-        # データをダウンロード
-        df = kabu_plus_download(CSVEX_URL, path, frequency, symbol)
+    # データを整形して、日付順にテーブルに追加
+    def write(symbol: str, df: pd.DataFrame) -> None:
+        print(f"  {symbol} のデータを追加中...")
+        df.to_sql(table_name, conn, if_exists="append", index=False)
 
-        # データがない場合は終了
-        if df is not None:
-            print(f"  {symbol} のデータを追加中...")
+    transform_all(stocks, path, frequency, symbols, write)
 
-            # データを整形して、テーブルに追加
-            df = restructure_data(stocks, path, df)
-            # dateカラムがない場合は追加
-            if "日付" not in df.columns:
-                df["日付"] = int(symbol)
-            df.to_sql(table_name, conn, if_exists="append", index=False)
+    # 週足・月足を更新
+    if table_name in rollup.SOURCES:
+        rollup.update_rollups(conn, table_name)
 
-        # 日付を１日進める
-        mydate += pd.Timedelta(days=1)
+    # 株価データは列ファイルにも追記
+    if table_name == "株価データ":
+        colstore.export(conn)
+    conn.close()
 
-        # 今日より未来の日付になったら終了
-        if mydate > pd.to_datetime("today"):
-            conn.close()
-            break
+
+# -- データの欠損を修復する関数 --#
+def repair_data(stocks: pd.DataFrame, path: str, table_name: str, years: int = 1) -> None:
+
+    print(f"{table_name} の欠損を修復中...")
+
+    # SQLiteのコネクションを取得
+    db_path = Path(__file__).with_name("db.sqlite3")
+    conn = sqlite3.connect(db_path)
+
+    # 欠損を検出して日付ごとにまとめる（指数データは銘柄マスタと関係しない）
+    start = pd.Timestamp.now() - pd.DateOffset(years=years)
+    missing = gaps.scan(conn, table_name, stocks if path != "tosho-index-data" else None, start)
+    plan = gaps.plan_dates(missing)
+    print(f"  修復計画: {len(plan)}日（欠損: {len(missing)}件）")
+
+    # 欠損のある日付のみデータを取得し、欠損している銘柄のみテーブルに追加する
+    missing_codes = dict(zip(plan["日付"].dt.strftime("%Y%m%d"), plan["コード"]))
+
+    def write(symbol: str, df: pd.DataFrame) -> None:
+        print(f"  {symbol} のデータを追加中...")
+        df = df[df["コード"].astype(str).isin(missing_codes[symbol])]
+        df.to_sql(table_name, conn, if_exists="append", index=False)
+
+    transform_all(stocks, path, "daily", list(missing_codes), write)
+
+    # 修復した日付以降の週足・月足と列ファイル、自作指数を作成し直す
+    if not plan.empty:
+        if table_name in rollup.SOURCES:
+            rollup.update_rollups(conn, table_name, since=plan["日付"].min())
+        if table_name == "株価データ":
+            colstore.export(conn, rebuild=True)
+        if table_name in ["株価データ", "指標データ"]:
+            indices.update_indices(conn, stocks, since=plan["日付"].min())
+    conn.close()
+
+
+# -- ダウンロードと変換を並行して行う関数 --#
+def transform_all(stocks: pd.DataFrame, path: str, frequency: str, symbols: list, write) -> None:
+    """
+    日付ごとのCSVをメインプロセスでダウンロードし、Shift-JISのデコードと整形をプロセスプールで並列に行います。
+    変換済みの DataFrame は日付順に write に渡し、テーブルへの書き込みはメインプロセスのみで行います。
+    処理中のファイルは MAX_IN_FLIGHT 件までとし、上限に達したら最も古い日付の変換を待って書き込みます。
+
+    Args:
+        stocks (pd.DataFrame): 銘柄マスタ。
+        path (str): kabu+ のデータの種類。
+        frequency (str): daily または monthly。
+        symbols (list): 取得する日付（yyyyMMdd）のリスト。
+        write (Callable[[str, pd.DataFrame], None]): 日付と変換済みの DataFrame を受け取って書き込む関数。
+    """
+    if not symbols:
+        return
+
+    # ワーカーには銘柄コードのみ渡す
+    with ProcessPoolExecutor(max_workers=TRANSFORM_PROCESSES, initializer=init_worker, initargs=(stocks["コード"].values,)) as executor:
+        pending = deque()
+        for symbol in symbols:
+            # データをダウンロード（データがない場合はスキップ）
+            content = kabu_plus_download(CSVEX_URL, path, frequency, symbol)
+            if content is None:
+                continue
+            pending.append((symbol, executor.submit(transform_worker, path, content, symbol)))
+
+            # 処理中の件数が上限に達したら古い日付から書き込む
+            while len(pending) >= MAX_IN_FLIGHT:
+                symbol, future = pending.popleft()
+                write(symbol, future.result())
+
+        # 残りを日付順に書き込む
+        while pending:
+            symbol, future = pending.popleft()
+            write(symbol, future.result())
+
+
+def init_worker(codes) -> None:
+    """
+    ワーカープロセスに銘柄コードを渡します。
+    """
+    global _stocks
+    _stocks = pd.DataFrame({"コード": codes})
+
+
+def transform_worker(path: str, content: bytes, symbol: str) -> pd.DataFrame:
+    """
+    ワーカープロセスで CSV をデコードして整形します。戻り値は整形後の列・行のみの DataFrame です。
+    """
+    df = pd.read_csv(io.BytesIO(content), encoding="shift_jis")
+    df = restructure_data(_stocks, path, df)
+
+    # dateカラムがない場合は追加
+    if "日付" not in df.columns:
+        df["日付"] = int(symbol)
+    return df
 
 
 def restructure_data(stocks: pd.DataFrame, path: str, df: pd.DataFrame) -> pd.DataFrame:
@@ -171,19 +274,19 @@ def restructure_data(stocks: pd.DataFrame, path: str, df: pd.DataFrame) -> pd.Da
 
 
 # -- kabu+からデータをダウンロードする関数 --#
-def kabu_plus_download(url: str, path: str, frequency: str, symbol: str) -> pd.DataFrame:
+def kabu_plus_download(url: str, path: str, frequency: str, symbol: str) -> bytes:
 
     # CSVEXからデータを取得
     url = url.format(path=path, frequency=frequency, symbol=symbol)
     r = requests.get(url, auth=(myenv.KABU_PLUS_USER, myenv.KABU_PLUS_PASS))
 
-    # 404の場合はデータなしとしてNoneを返す
+    # 404の場合はデータなしとしてNoneを返す（デコードは変換のプロセスで行う）
     if r.status_code == 404:
         return None
     # その他のエラーは例外を発生させる
     r.raise_for_status()
 
-    return pd.read_csv(io.BytesIO(r.content), encoding="shift_jis")
+    return r.content
 
 
 if __name__ == "__main__":
@@ -197,6 +300,23 @@ if __name__ == "__main__":
         update_data(stocks, "japan-all-stock-data", "指標データ", "daily")
         update_data(stocks, "tosho-index-data", "指数データ", "daily")
         update_data(stocks, "japan-all-stock-financial-results", "決算データ_毎月", "monthly")
+
+        # 指標データの時価総額から自作指数を追加し、ファクターのバリュエーションを最新の株価で計算し直す
+        conn = sqlite3.connect(Path(__file__).with_name("db.sqlite3"))
+        try:
+            indices.update_indices(conn, stocks)
+            factor.update_valuations(conn)
+        finally:
+            conn.close()
         print("各種データの更新が完了しました。")
+    elif len(sys.argv) > 1 and sys.argv[1] == "repair":
+        print("JPX銘柄一覧を読み込み中...")
+        stocks = jpx.load()
+
+        print("各種データの欠損を修復中...")
+        repair_data(stocks, "tosho-stock-ohlc", "株価データ")
+        repair_data(stocks, "japan-all-stock-data", "指標データ")
+        repair_data(stocks, "tosho-index-data", "指数データ")
+        print("各種データの修復が完了しました。")
     else:
-        print("usage: python kabu-plus.py update")
+        print("usage: python kabu-plus.py update or repair")
@@ -0,0 +1,207 @@
+import sqlite3
+from typing import Iterator
+import pandas as pd
+import rollup
+import archive
+import colstore
+import findata
+
+"""
+アプリ（app/home.py）とデータAPI（api.py）で共通に使う読み込み処理。
+時系列は日足なら列ファイル（株価データのみ）とアーカイブDBを含む日次のテーブルから、週足・月足なら集計テーブルから読み込み、
+大きな期間でも全体をメモリに載せないように chunk_rows 行ずつの DataFrame を返す。
+"""
+
+# 足の名前とテーブル名の接尾辞
+RESOLUTIONS = {"日足": "", "週足": "_週足", "月足": "_月足"}
+
+# 時系列のテーブル
+SERIES_TABLES = ["株価データ", "指数データ", "自作指数データ"]
+
+# 1回に返す行数
+CHUNK_ROWS = 100_000
+
+
+def series(
+    conn: sqlite3.Connection,
+    table_name: str,
+    codes: list = None,
+    start: pd.Timestamp = None,
+    end: pd.Timestamp = None,
+    resolution: str = "日足",
+    columns: list = None,
+    chunk_rows: int = CHUNK_ROWS,
+) -> Iterator[pd.DataFrame]:
+    """
+    時系列を縦持ちの DataFrame で chunk_rows 行ずつ読み込みます。日付は datetime、コードは文字列にします。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        table_name (str): テーブル名（株価データ、指数データ、自作指数データ）。
+        codes (list): 銘柄コード。None の場合は全銘柄。
+        start (pd.Timestamp): 開始日。None の場合は最初から。
+        end (pd.Timestamp): 終了日。None の場合は最後まで。
+        resolution (str): 足（日足、週足、月足）。
+        columns (list): 'コード', '日付' 以外に読み込む列。None の場合は全列。
+        chunk_rows (int): 1回に返す行数。
+
+    Yields:
+        pd.DataFrame: 'コード', '日付' と指定した列を持つ DataFrame。行がない場合も1回は返します。
+    """
+    if table_name not in SERIES_TABLES:
+        raise ValueError(f"{table_name} は時系列のテーブルではありません")
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"{resolution} は未対応の足です")
+
+    # 日足の株価データは列ファイルにある分を memmap から読み込み、列ファイルに未反映の行のみ SQLite から読み込む
+    empty = True
+    store = colstore.open_store() if table_name == "株価データ" and resolution == "日足" else None
+
+    # rowid が振り直されて列ファイルに未反映の行を判定できない場合は、列ファイルを書き出し直すまで SQLite から読み込む
+    if store is not None and colstore.rowids_reset(conn, colstore.read_meta()):
+        store = None
+
+    # 指定した列が読み込むテーブル（列ファイルの場合は列ファイル）にあるか先に確認する
+    if columns is not None:
+        if store is not None:
+            available = list(colstore.COLUMNS)
+        else:
+            available = [row[1] for row in conn.execute(f"PRAGMA table_info({findata.quote_name(table_name + RESOLUTIONS[resolution])})")]
+        unknown = [col for col in columns if col not in available or col in ["コード", "日付"]]
+        if unknown:
+            raise ValueError(f"{', '.join(unknown)} は {table_name} の列ではありません")
+    if store is not None:
+        rows = colstore.select(store, codes, start, end)
+        count = rows.stop - rows.start if isinstance(rows, slice) else len(rows)
+        for i in range(0, count, chunk_rows):
+            stop = min(i + chunk_rows, count)
+            # 全銘柄の場合はスライスのまま読み込む（行の位置の配列を作らない）
+            if isinstance(rows, slice):
+                chunk = slice(rows.start + i, rows.start + stop)
+            else:
+                chunk = rows[i:stop]
+            df = pd.DataFrame({"コード": store["codes"][store["コード"][chunk]], "日付": store["日付"][chunk].astype("datetime64[ns]")})
+            for col in columns or ["始値", "高値", "安値", "終値", "出来高"]:
+                df[col] = store[col][chunk]
+            empty = False
+            yield df
+
+    # 条件は日付の区切り文字によらず yyyymmdd で比較する
+    conditions = []
+    params = []
+    if codes is not None:
+        conditions.append(f"コード IN ({','.join('?' * len(codes))})")
+        params += [str(code) for code in codes]
+    if end is not None:
+        conditions.append(f"{rollup.DATE_KEY} <= ?")
+        params.append(pd.Timestamp(end).strftime("%Y%m%d"))
+    select = "*" if columns is None else ", ".join(["コード", "日付"] + [findata.quote_name(col) for col in columns])
+
+    if store is not None:
+        # 列ファイルに書き出した最終 rowid より後に追加された行（日付は問わない）をメインのDBから読み込む
+        # （rowid を記録していない旧形式のメタ情報の場合は最終日付より後の行）
+        meta = colstore.read_meta()
+        if meta.get("last_rowid") is not None:
+            conditions.append("rowid > ?")
+            params.append(meta["last_rowid"])
+        else:
+            conditions.append(f"{rollup.DATE_KEY} > ?")
+            params.append(meta["last_date"].replace("-", ""))
+        if start is not None:
+            conditions.append(f"{rollup.DATE_KEY} >= ?")
+            params.append(pd.Timestamp(start).strftime("%Y%m%d"))
+        query = f"SELECT {select} FROM main.{table_name} WHERE {' AND '.join(conditions)}"
+        frames = pd.read_sql_query(query, conn, params=params, chunksize=chunk_rows)
+    elif resolution == "日足":
+        # 日足はアーカイブ済みの年にかかる場合のみアーカイブDBからも読み込む
+        frames = archive.iter_read(conn, table_name, select, start, " AND ".join(conditions) or None, params, chunksize=chunk_rows)
+    else:
+        # 週足・月足は集計テーブルから読み込む
+        if start is not None:
+            conditions.append(f"{rollup.DATE_KEY} >= ?")
+            params.append(pd.Timestamp(start).strftime("%Y%m%d"))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"SELECT {select} FROM {table_name}{RESOLUTIONS[resolution]}{where}"
+        frames = pd.read_sql_query(query, conn, params=params, chunksize=chunk_rows)
+
+    for df in frames:
+        if df.empty:
+            continue
+        empty = False
+        df["コード"] = df["コード"].astype(str)
+        df["日付"] = rollup.parse_dates(df["日付"])
+        yield df
+
+    if empty:
+        yield pd.DataFrame({"コード": pd.Series(dtype=str), "日付": pd.Series(dtype="datetime64[ns]"), **{col: pd.Series(dtype=float) for col in columns or []}})
+
+
+def indicators(conn: sqlite3.Connection, codes: list = None, date: pd.Timestamp = None) -> pd.DataFrame:
+    """
+    指定した日（None の場合は最新日）以前で最も新しい日の指標データを読み込みます。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        codes (list): 銘柄コード。None の場合は全銘柄。
+        date (pd.Timestamp): 基準日。None の場合は最新日。
+
+    Returns:
+        pd.DataFrame: 指標データの DataFrame。
+    """
+    where = f"{rollup.DATE_KEY} <= ?" if date is not None else None
+    params = [pd.Timestamp(date).strftime("%Y%m%d")] if date is not None else []
+
+    # 基準日以前の最新日はメインのDBにあればメインのDBから、なければアーカイブDBから求める
+    query = f"SELECT MAX({rollup.DATE_KEY}) FROM main.指標データ"
+    if where is not None:
+        query += f" WHERE {where}"
+    latest = conn.execute(query, params).fetchone()[0]
+    if latest is None:
+        dates = [df.iloc[0, 0] for df in archive.iter_read(conn, "指標データ", f"MAX({rollup.DATE_KEY})", None, where, params) if df.iloc[0, 0] is not None]
+        latest = max(dates, default=None)
+
+    # 最新日の行を、その年のアーカイブDBを含めて読み込む
+    where = f"{rollup.DATE_KEY} = ?"
+    params = [latest]
+    if codes is not None:
+        where += f" AND コード IN ({','.join('?' * len(codes))})"
+        params += [str(code) for code in codes]
+    start = pd.Timestamp(str(latest)) if latest is not None else None
+    return archive.read(conn, "指標データ", "*", start, where, params)
+
+
+def financials(conn: sqlite3.Connection, table_name: str, codes: list = None, items: list = None) -> pd.DataFrame:
+    """
+    財務データを横持ちで読み込みます（findata.load）。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        table_name (str): 横持ちビューの名前（財務諸表_FIN など）。
+        codes (list): 銘柄コード。None の場合は全銘柄。
+        items (list): 項目名（英語）。None の場合は全項目。
+
+    Returns:
+        pd.DataFrame: 'コード', '決算期' と各項目の列を持つ DataFrame。
+    """
+    if table_name not in findata.VIEW_TYPES:
+        raise ValueError(f"{table_name} は財務データのビューではありません")
+    return findata.load(conn, table_name, codes, items)
+
+
+def factors(conn: sqlite3.Connection, codes: list = None) -> pd.DataFrame:
+    """
+    ファクターデータを読み込みます。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        codes (list): 銘柄コード。None の場合は全銘柄。
+
+    Returns:
+        pd.DataFrame: ファクターデータの DataFrame。
+    """
+    query = "SELECT * FROM ファクターデータ"
+    params = []
+    if codes is not None:
+        query += f" WHERE コード IN ({','.join('?' * len(codes))})"
+        params += [str(code) for code in codes]
+    return pd.read_sql_query(query, conn, params=params)
@@ -0,0 +1,124 @@
+import sys
+import sqlite3
+import pandas as pd
+import archive
+
+"""
+株価データ、指数データ、自作指数データの日足から週足・月足のテーブルを作成する。
+週足は週の月曜日、月足は月の1日を日付とし、既存の最終期間以降のみ再集計する。
+"""
+
+# 集計元のテーブル
+SOURCES = ["株価データ", "指数データ", "自作指数データ"]
+
+# 足の種類（テーブル名の接尾辞, pandasの期間）
+RESOLUTIONS = [("週足", "W-SUN"), ("月足", "M")]
+
+# 四本値と出来高の集計方法
+AGGREGATIONS = {"始値": "first", "高値": "max", "安値": "min", "終値": "last", "出来高": "sum", "指数名": "last"}
+
+# 日付の形式（yyyy-MM-dd, yyyy/MM/dd, yyyyMMdd）によらず比較するための式
+DATE_KEY = "REPLACE(REPLACE(日付, '-', ''), '/', '')"
+
+
+def update_rollups(conn: sqlite3.Connection, table_name: str, since: pd.Timestamp = None) -> None:
+    """
+    日足のテーブルから週足・月足のテーブルを更新します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        table_name (str): 集計元のテーブル名（株価データ、指数データ）。
+        since (pd.Timestamp): この日付を含む期間以降を再集計します。None の場合は既存の最終期間以降。
+    """
+    for suffix, freq in RESOLUTIONS:
+        rollup_name = f"{table_name}_{suffix}"
+        print(f"{rollup_name} を更新中...")
+
+        # 再集計を開始する期間の初日を決める
+        start = None
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (rollup_name,)).fetchone():
+            if since is not None:
+                start = pd.Timestamp(since).to_period(freq).start_time
+            else:
+                last = conn.execute(f"SELECT MAX(日付) FROM {rollup_name}").fetchone()[0]
+                start = pd.to_datetime(last) if last is not None else None
+
+        # 集計元のデータを読み込む（全件の場合はアーカイブ済みの年も含める）
+        df = archive.read(conn, table_name, start=start)
+
+        if df.empty:
+            continue
+        df = rollup(df, freq)
+
+        # 再集計した期間を置き換える
+        if start is not None:
+            conn.execute(f"DELETE FROM {rollup_name} WHERE 日付 >= ?", (start.strftime("%Y-%m-%d"),))
+        else:
+            conn.execute(f"DROP TABLE IF EXISTS {rollup_name}")
+            create_table(conn, rollup_name, df)
+        df.to_sql(rollup_name, conn, if_exists="append", index=False)
+        conn.commit()
+
+
+def create_table(conn: sqlite3.Connection, rollup_name: str, df: pd.DataFrame) -> None:
+    """
+    コード、日付を主キーとする週足・月足のテーブルを作成します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        rollup_name (str): 作成するテーブル名。
+        df (pd.DataFrame): 集計済みの DataFrame。列の定義に使用します。
+    """
+    columns = ", ".join(f"{col} {'TEXT' if col in ['コード', '日付', '指数名'] else 'REAL'}" for col in df.columns)
+    conn.execute(f"CREATE TABLE {rollup_name} ({columns}, PRIMARY KEY (コード, 日付))")
+
+
+def rollup(df: pd.DataFrame, freq: str) -> pd.DataFrame:
+    """
+    日足の DataFrame を週足・月足に集計します。
+
+    Args:
+        df (pd.DataFrame): 'コード', '日付' と四本値の列を持つ日足の DataFrame。
+        freq (str): pandas の期間（W-SUN, M）。
+
+    Returns:
+        pd.DataFrame: 日付を期間の初日（yyyy-MM-dd）とした DataFrame。
+    """
+    # 日付を日付型に変換して期間の初日を求める
+    df = df.copy()
+    df["日付"] = parse_dates(df["日付"])
+    df["期間"] = df["日付"].dt.to_period(freq).dt.start_time
+
+    # コード、期間ごとに集計
+    df = df.sort_values(["コード", "日付"])
+    aggregations = {col: func for col, func in AGGREGATIONS.items() if col in df.columns}
+    df = df.groupby(["コード", "期間"], sort=False).agg(aggregations).reset_index()
+
+    # 期間の初日を日付とする
+    df = df.rename(columns={"期間": "日付"})
+    df["日付"] = df["日付"].dt.strftime("%Y-%m-%d")
+    return df
+
+
+def parse_dates(dates: pd.Series) -> pd.Series:
+    """
+    yyyy-MM-dd, yyyy/MM/dd, yyyyMMdd の日付を日付型に変換します。
+    """
+    return pd.to_datetime(dates.astype(str).str.replace(r"[-/]", "", regex=True).str[:8], format="%Y%m%d")
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild":
+        conn = sqlite3.connect("db.sqlite3")
+        try:
+            for table_name in SOURCES:
+                if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table_name,)).fetchone():
+                    for suffix, _ in RESOLUTIONS:
+                        conn.execute(f"DROP TABLE IF EXISTS {table_name}_{suffix}")
+                    update_rollups(conn, table_name)
+        finally:
+            conn.close()
+        print("週足・月足の再作成が完了しました。")
+    else:
+        print("usage: python rollup.py rebuild")
@@ -0,0 +1,129 @@
+import sys
+import sqlite3
+import unicodedata
+import pandas as pd
+
+"""
+銘柄マスタのコード、銘柄名、読み（銘柄読みテーブルがある場合）から銘柄検索の索引を作成し、入力された文字列で銘柄を検索する。
+索引は FTS5 の trigram で部分一致を検索し、3文字未満の入力はコードと検索キーの前方一致で検索する。
+検索キーは NFKC で正規化し、ひらがなをカタカナに変換して全角・半角、ひらがな・カタカナの違いを吸収する。
+銘柄マスタを更新した時に索引を作成し直す。
+"""
+
+# 検索の索引のテーブル
+SEARCH_TABLE = "銘柄検索"
+
+# 銘柄の読み（コード, 読み）のテーブル
+READING_TABLE = "銘柄読み"
+
+# 検索結果の最大件数
+LIMIT = 50
+
+
+def normalize(text: str) -> str:
+    """
+    検索用に文字列を正規化します。全角英数字を半角、英字を小文字、ひらがなをカタカナにします。
+
+    Args:
+        text (str): 文字列。
+
+    Returns:
+        str: 正規化した文字列。
+    """
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    return "".join(chr(ord(c) + 0x60) if "ぁ" <= c <= "ゖ" else c for c in text)
+
+
+def build_index(conn: sqlite3.Connection) -> int:
+    """
+    銘柄マスタから検索の索引を作成し直します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+
+    Returns:
+        int: 索引に追加した銘柄数。
+    """
+    df = pd.read_sql_query('SELECT コード, 銘柄名, "市場・商品区分", "33業種区分" FROM 銘柄マスタ', conn)
+    df["コード"] = df["コード"].astype(str)
+
+    # 銘柄読みテーブルがあれば読みも検索キーに含める
+    readings = pd.Series("", index=df.index)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (READING_TABLE,)).fetchone():
+        reading = pd.read_sql_query(f"SELECT コード, 読み FROM {READING_TABLE}", conn)
+        reading = reading.set_index(reading["コード"].astype(str))["読み"]
+        readings = df["コード"].map(reading).fillna("")
+    df["検索キー"] = [normalize(f"{code} {name} {reading}") for code, name, reading in zip(df["コード"], df["銘柄名"], readings)]
+
+    conn.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+    conn.execute(
+        f"""
+        CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+            コード UNINDEXED, 銘柄名 UNINDEXED, "市場・商品区分" UNINDEXED, "33業種区分" UNINDEXED, 検索キー,
+            tokenize = 'trigram'
+        )
+        """
+    )
+    conn.executemany(
+        f"INSERT INTO {SEARCH_TABLE} VALUES (?, ?, ?, ?, ?)",
+        df[["コード", "銘柄名", "市場・商品区分", "33業種区分", "検索キー"]].itertuples(index=False, name=None),
+    )
+    conn.commit()
+    return len(df)
+
+
+def search(conn: sqlite3.Connection, query: str, limit: int = LIMIT) -> pd.DataFrame:
+    """
+    銘柄を検索します。コードが前方一致する銘柄、銘柄名が前方一致する銘柄、部分一致する銘柄の順に返します。
+    索引がない場合は作成します。
+
+    Args:
+        conn (sqlite3.Connection): SQLite のコネクション。
+        query (str): 検索する文字列。
+        limit (int): 最大件数。
+
+    Returns:
+        pd.DataFrame: 'コード', '銘柄名', '市場・商品区分', '33業種区分' の DataFrame。
+    """
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name=?", (SEARCH_TABLE,)).fetchone():
+        build_index(conn)
+
+    query = normalize(query).strip()
+    columns = 'コード, 銘柄名, "市場・商品区分", "33業種区分"'
+    if query == "":
+        return pd.DataFrame(columns=["コード", "銘柄名", "市場・商品区分", "33業種区分"])
+
+    # 前方一致を優先して並べる
+    order = "CASE WHEN コード LIKE :prefix THEN 0 WHEN substr(検索キー, length(コード) + 2) LIKE :prefix THEN 1 ELSE 2 END, コード"
+    params = {"query": query, "prefix": query.replace("%", "").replace("_", "") + "%", "limit": limit}
+
+    if len(query) >= 3:
+        # 3文字以上は trigram の索引で部分一致を検索する
+        phrase = '"' + query.replace('"', '""') + '"'
+        sql = f"SELECT {columns} FROM {SEARCH_TABLE} WHERE 検索キー MATCH :phrase ORDER BY {order} LIMIT :limit"
+        params["phrase"] = phrase
+    else:
+        # 3文字未満は索引を使えないため、全銘柄（数千件）の検索キーから部分一致を検索する
+        sql = f"SELECT {columns} FROM {SEARCH_TABLE} WHERE instr(検索キー, :query) > 0 ORDER BY {order} LIMIT :limit"
+
+    return pd.read_sql_query(sql, conn, params=params)
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1 and sys.argv[1] == "build":
+        conn = sqlite3.connect("db.sqlite3")
+        try:
+            print(f"{SEARCH_TABLE} を作成中...")
+            count = build_index(conn)
+        finally:
+            conn.close()
+        print(f"銘柄検索の索引を作成しました。（{count}銘柄）")
+    elif len(sys.argv) > 2 and sys.argv[1] == "query":
+        conn = sqlite3.connect("db.sqlite3")
+        try:
+            print(search(conn, sys.argv[2]).to_string(index=False))
+        finally:
+            conn.close()
+    else:
+        print("usage: python search.py build|query 文字列")
@@ -4,6 +4,11 @@ import pandas as pd
 import sqlite3
 import jpx
 import en2ja
+import findata
+import factor
+import rollup
+import colstore
+import gaps
 
 to_ja = en2ja.to_ja
 
@@ -51,56 +56,197 @@ def update_price_data(stocks: pd.DataFrame) -> None:
             print("株価データが存在しません。5年分のデータを取得します。")
             df = ticker.history(period="5y")
 
-        # インデックスを日付列に変換
-        df = df.reset_index()
+        # 株価データテーブルに追加
+        df = to_price_table(df, code)
+        df.to_sql("株価データ", conn, if_exists="append", index=False)
+
+    # 週足・月足と列ファイルを更新
+    rollup.update_rollups(conn, "株価データ")
+    colstore.export(conn)
+    conn.close()
+
+
+def repair_price_data(stocks: pd.DataFrame, years: int = 5) -> None:
+    """
+    株価データの欠損している（コード, 日付）のみを Yahoo Finance から取得して SQLite に保存します。
 
-        # Date 列を日付型に変換
-        df["Date"] = pd.to_datetime(df["Date"]).dt.date
+    Args:
+        stocks (pd.DataFrame): 銘柄コードの DataFrame。'コード' 列を含む必要があります。
+        years (int): 欠損を検出する年数。
+    """
 
-        # Date, Open, High, Low, Close, Volume 列のみ抽出
-        df = df[["Date", "Open", "High", "Low", "Close", "Volume"]]
+    conn = sqlite3.connect("db.sqlite3")
 
-        # Date, Open, High, Low, Close, Volume を日本語に変換
-        df = df.rename(columns={"Date": "日付", "Open": "始値", "High": "高値", "Low": "安値", "Close": "終値", "Volume": "出来高"})
+    # 欠損を検出して銘柄ごとの範囲にまとめる
+    start = pd.Timestamp.now() - pd.DateOffset(years=years)
+    missing = gaps.scan(conn, "株価データ", stocks, start)
+    plan = gaps.plan_ranges(conn, missing, start)
+    print(f"修復計画: {len(plan)}件（欠損: {len(missing)}件）")
 
-        # 銘柄コードの列を追加
-        df["コード"] = code
+    for row in plan.itertuples(index=False):
 
-        # インデックスをコード、日付に設定
-        df = df.set_index(["コード", "日付"]).reset_index()
+        print(f"コードを処理中: {row.コード} {row.開始日:%Y-%m-%d}〜{row.終了日:%Y-%m-%d}")
 
-        # 株価データテーブルに追加
+        # Yahoo Finance のティッカーオブジェクトを取得
+        if row.コード == "N225":
+            ticker = yf.Ticker("^N225")
+        else:
+            ticker = yf.Ticker(f"{row.コード}.T")
+
+        # 欠損している範囲のみ取得して追加
+        df = ticker.history(start=row.開始日, end=row.終了日 + pd.Timedelta(days=1))
+        if df.empty:
+            continue
+        df = to_price_table(df, row.コード)
+        df = df[(df["日付"] >= row.開始日.date()) & (df["日付"] <= row.終了日.date())]
         df.to_sql("株価データ", conn, if_exists="append", index=False)
 
+    # 修復した日付以降の週足・月足と列ファイルを作成し直す
+    if not plan.empty:
+        rollup.update_rollups(conn, "株価データ", since=plan["開始日"].min())
+        colstore.export(conn, rebuild=True)
+    conn.close()
+
+
+def to_price_table(df: pd.DataFrame, code: str) -> pd.DataFrame:
+    """
+    Yahoo Finance の株価データを株価データテーブルの形式に変換します。
+
+    Args:
+        df (pd.DataFrame): Yahoo Finance の株価データ。インデックスが日付。
+        code (str): 銘柄コード。
+
+    Returns:
+        pd.DataFrame: 'コード', '日付', '始値', '高値', '安値', '終値', '出来高' 列を持つ DataFrame。
+    """
+    # インデックスを日付列に変換
+    df = df.reset_index()
+
+    # Date 列を日付型に変換
+    df["Date"] = pd.to_datetime(df["Date"]).dt.date
+
+    # Date, Open, High, Low, Close, Volume 列のみ抽出
+    df = df[["Date", "Open", "High", "Low", "Close", "Volume"]]
+
+    # Date, Open, High, Low, Close, Volume を日本語に変換
+    df = df.rename(columns={"Date": "日付", "Open": "始値", "High": "高値", "Low": "安値", "Close": "終値", "Volume": "出来高"})
+
+    # 銘柄コードの列を追加
+    df["コード"] = code
+
+    # インデックスをコード、日付に設定
+    return df.set_index(["コード", "日付"]).reset_index()
+
+
+# 財務データの種類（Yahoo Finance の属性名, ビュー名, データ種別）
+FIN_DATA = [
+    ("financials", "財務諸表_FIN", "fin"),
+    ("balance_sheet", "賃借対照表_BS", "bs"),
+    ("financials", "損益計算書_PL", "pl"),
+    ("cashflow", "キャッシュフロー計算書_CF", "cf"),
+    ("quarterly_financials", "財務諸表_FINQTY", "fin"),
+    ("quarterly_balance_sheet", "賃借対照表_BSQTY", "bs"),
+    ("quarterly_income_stmt", "損益計算書_PLQTY", "pl"),
+    ("quarterly_cashflow", "キャッシュフロー計算書_CFQTY", "cf"),
+]
+
+
+# 決算発表後、Yahoo Finance への反映を待って取得し直す日数
+FETCH_LAG_DAYS = 14
+
+# 四半期末から四半期決算の発表までの目安の日数
+QUARTER_REPORT_DAYS = 45
+
+# この日数以上取得していない銘柄は決算発表に関係なく取得する
+MAX_FETCH_AGE_DAYS = 120
+
+
+def select_report_stocks(stocks: pd.DataFrame) -> pd.DataFrame:
+    """
+    決算データ_毎月の決算発表日（本決算）と決算期、銘柄ごとの前回の取得日時から、
+    新しい決算が発表された（または発表直後の）銘柄のみを選びます。
+
+    以下のいずれかに該当する銘柄を選びます。
+    - 一度も取得していない、または MAX_FETCH_AGE_DAYS 日以上取得していない
+    - 前回の取得以降（または直近 FETCH_LAG_DAYS 日以内）に本決算が発表された
+    - 前回の取得以降（または直近 FETCH_LAG_DAYS 日以内）に四半期決算の発表予定日（四半期末 + QUARTER_REPORT_DAYS 日）がある
+
+    Args:
+        stocks (pd.DataFrame): 銘柄コードの DataFrame。'コード' 列を含む必要があります。
+
+    Returns:
+        pd.DataFrame: 選んだ銘柄の DataFrame。
+    """
+    today = pd.Timestamp.now().normalize()
+    df = pd.DataFrame({"コード": stocks["コード"].astype(str).values})
+
+    conn = sqlite3.connect("db.sqlite3")
+    try:
+        findata.create_tables(conn)
+
+        # 銘柄ごとの前回の取得日時
+        fetched = pd.read_sql_query(f"SELECT コード, 取得日時 FROM {findata.FETCH_TABLE}", conn)
+        df = df.merge(fetched, on="コード", how="left")
+
+        # 決算データ_毎月の最新の月の決算発表日（本決算）と決算期
+        if factor.table_exists(conn, "決算データ_毎月"):
+            kabu = pd.read_sql_query(
+                """
+                SELECT k.コード, k."決算発表日（本決算）" AS 発表日, k.決算期
+                FROM 決算データ_毎月 k
+                JOIN (SELECT コード, MAX(日付) AS 日付 FROM 決算データ_毎月 GROUP BY コード) m ON m.コード = k.コード AND m.日付 = k.日付
+                """,
+                conn,
+            )
+            kabu["コード"] = kabu["コード"].astype(str)
+            df = df.merge(kabu, on="コード", how="left")
+        else:
+            df["発表日"] = None
+            df["決算期"] = None
+    finally:
+        conn.close()
+
+    # 日付型に変換（発表日は yyyyMMdd、決算期は yyyyMM）
+    last_fetch = pd.to_datetime(df["取得日時"], errors="coerce").dt.normalize()
+    announced = pd.to_datetime(df["発表日"].astype("Int64").astype(str), format="%Y%m%d", errors="coerce")
+    fiscal_end = pd.to_datetime(df["決算期"].astype("Int64").astype(str).str[:6], format="%Y%m", errors="coerce") + pd.offsets.MonthEnd(0)
+
+    # 前回の取得日時と直近 FETCH_LAG_DAYS 日のうち早い方から今日までを対象期間とする
+    since = last_fetch.where(last_fetch < today - pd.Timedelta(days=FETCH_LAG_DAYS), today - pd.Timedelta(days=FETCH_LAG_DAYS))
+
+    def in_window(dates: pd.Series) -> pd.Series:
+        return (dates > since) & (dates <= today)
+
+    # 本決算の発表日
+    selected = in_window(announced)
+
+    # 四半期決算の発表予定日（前期末から来期末までの四半期末 + QUARTER_REPORT_DAYS 日）
+    for quarter in range(-4, 5):
+        quarter_end = fiscal_end + pd.DateOffset(months=3 * quarter) + pd.offsets.MonthEnd(0)
+        selected |= in_window(quarter_end + pd.Timedelta(days=QUARTER_REPORT_DAYS))
+
+    # 未取得または長期間取得していない銘柄
+    selected |= last_fetch.isna() | (last_fetch < today - pd.Timedelta(days=MAX_FETCH_AGE_DAYS))
+
+    return stocks[selected.values]
+
 
 def update_financial_data(stocks: pd.DataFrame, from_local: bool = False) -> None:
     """
     Yahoo Finance から各種財務データを取得して SQLite に保存します。
+    財務データは縦持ちで保存し、変更のあった行のみ書き込みます。
 
     Args:
         stocks (pd.DataFrame): 銘柄コードの DataFrame。'コード' 列を含む必要があります。
         from_local (bool): ローカルデータから読み込む場合は True。デフォルトは False でYahooから取得します。
     """
 
-    # 各種データの初期化
-    all_data = [
-        [None, "financials", "財務諸表_FIN", "fin"],
-        [None, "balance_sheet", "賃借対照表_BS", "bs"],
-        [None, "financials", "損益計算書_PL", "pl"],
-        [None, "cashflow", "キャッシュフロー計算書_CF", "cf"],
-        [None, "quarterly_financials", "財務諸表_FINQTY", "fin"],
-        [None, "quarterly_balance_sheet", "賃借対照表_BSQTY", "bs"],
-        [None, "quarterly_income_stmt", "損益計算書_PLQTY", "pl"],
-        [None, "quarterly_cashflow", "キャッシュフロー計算書_CFQTY", "cf"],
-    ]
+    conn = sqlite3.connect("db.sqlite3")
+    findata.create_tables(conn)
 
     if from_local:
-        # ローカルデータから読み込み
-        print("ローカルデータから各種データを読み込み中...")
-
-        for data in all_data:
-            conn = sqlite3.connect("db.sqlite3")
-            data[0] = pd.read_sql(f"SELECT * FROM {data[2]}", conn)
+        # ローカルの財務データ（旧形式の横持ちテーブルは create_tables で移行済み）からビューのみ再作成
+        print("ローカルの財務データからビューを再作成中...")
 
     else:
         # Yahoo Finance からデータを取得
@@ -113,27 +259,40 @@ def update_financial_data(stocks: pd.DataFrame, from_local: bool = False) -> Non
             # Yahoo Finance のティッカーオブジェクトを取得
             ticker = yf.Ticker(f"{code}.T")
 
-            # 各種データを取得して追加
-            for data in all_data:
-                data[0] = append_table(data[0], getattr(ticker, data[1]), code)
+            # 各種データを取得して縦持ちで追加・更新
+            changed = 0
+            for attr, table_name, data_type in FIN_DATA:
+                changed += findata.upsert(conn, to_long(getattr(ticker, attr), code), table_name, data_type)
+
+            # 取得日時を記録
+            findata.record_fetch(conn, str(code), changed > 0)
+            conn.commit()
+            print(f"  更新件数: {changed}")
+
+    # 横持ちのビューを作成
+    for _, table_name, data_type in FIN_DATA:
+        findata.create_view(conn, table_name, data_type)
 
-            # 貸借対照表ログテーブルを読み込んで横持ち変換する
-            data[0] = data[0].pivot_table(index=["コード", "決算期"], columns=["項目"], values="値").reset_index()
+    # 財務データに変更のあった銘柄のファクターを再計算
+    factor.update_factors(conn)
 
-    # データを SQLite に保存
-    for data in all_data:
-        store_data(data[0], data[2], data[3])
+    conn.close()
 
 
-def append_table(df_all: pd.DataFrame, df: pd.DataFrame, code: str) -> None:
+def to_long(df: pd.DataFrame, code: str) -> pd.DataFrame:
     """
-    DataFrame のデータを 縦持ちに変換して df_all に追加します。
+    Yahoo Finance の財務データを縦持ちに変換します。
 
     Args:
-        df_all (pd.DataFrame): 追加先の DataFrame。最初は None で渡します。
-        df (pd.DataFrame): 追加する DataFrame。
+        df (pd.DataFrame): Yahoo Finance の財務データ。行が項目、列が決算期。
         code (str): 銘柄コード。
+
+    Returns:
+        pd.DataFrame: 'コード', '決算期', '項目', '値' 列を持つ DataFrame。
     """
+    if df is None or df.empty:
+        return None
+
     # データを縦持ちに変換
     df = df.reset_index().melt(id_vars=["index"])
     df.columns = ["項目", "決算期", "値"]
@@ -144,46 +303,8 @@ def append_table(df_all: pd.DataFrame, df: pd.DataFrame, code: str) -> None:
     # 銘柄コードの列を追加
     df["コード"] = code
 
-    # インデックスをコード、項目、決算期に設定
-    df = df.set_index(["コード", "決算期", "項目"]).reset_index()
-
-    # df_all に追加
-    if df_all is None:
-        df_all = df
-    else:
-        df_all = pd.concat([df_all, df], ignore_index=True)
-
-    return df_all
-
-
-def store_data(df: pd.DataFrame, table_name: str, data_type: str) -> None:
-    """
-    DataFrame を SQLite に保存します。
-
-    Args:
-        df (pd.DataFrame): 保存する DataFrame。
-        table_name (str): 保存先のテーブル名。
-        data_type (str): データ種別。列名変換に使用します。
-    """
-
-    # 日本語変換辞書を取得
-    my_to_ja = to_ja[data_type]
-
-    # 辞書にない列名をログに出力
-    for col in df.columns:
-        if col not in my_to_ja and col not in ["コード", "決算期"]:
-            if col not in my_to_ja.values():
-                print(f"未登録の列名: {col} （データ種別: {data_type}）")
-
-    # 列名を日本語に変換
-    df = df.rename(columns=my_to_ja) if data_type in to_ja else df
-
-    # テーブルをドロップクリエイト
-    conn = sqlite3.connect("db.sqlite3")
-    conn.execute(f"DROP TABLE IF EXISTS {table_name}")
-    conn.commit()
-
-    df.to_sql(table_name, conn, if_exists="replace", index=False)
+    # 列の並びをコード、決算期、項目、値にする
+    return df[["コード", "決算期", "項目", "値"]]
 
 
 def rename_columns(table_name: str, data_type: str) -> None:
@@ -221,6 +342,11 @@ if __name__ == "__main__":
         # 市場・商品区分がプライムのみに絞り込み
         stocks = stocks[stocks["市場・商品区分"] == "プライム"]
 
+        # allオプションがない場合は決算発表のあった銘柄のみに絞り込み
+        if not from_local and not (len(sys.argv) > 2 and sys.argv[2] == "all"):
+            stocks = select_report_stocks(stocks)
+            print(f"決算発表のあった銘柄: {len(stocks)}銘柄")
+
         print("各種データを更新中...")
         update_financial_data(stocks, from_local=from_local)
         # create_data()
@@ -235,5 +361,15 @@ if __name__ == "__main__":
         print("株価データを更新中...")
         update_price_data(stocks)
         print("株価データの更新が完了しました。")
+    elif len(sys.argv) > 1 and sys.argv[1] == "repair":
+        print("JPX銘柄一覧を読み込み中...")
+        stocks = jpx.load()
+
+        # 市場・商品区分がプライムのみに絞り込み
+        stocks = stocks[stocks["市場・商品区分"] == "プライム"]
+
+        print("株価データの欠損を修復中...")
+        repair_price_data(stocks)
+        print("株価データの修復が完了しました。")
     else:
-        print("usage: python yahoo.py fin [local] or price")
+        print("usage: python yahoo.py fin [local|all] or price or repair")